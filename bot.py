@@ -11,11 +11,14 @@ Text Master Bot - Telegram бот для извлечения текста из
 import os
 import sys
 import logging
-import tempfile
+import threading
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
+# Пул временных файлов для загружаемых изображений и голосовых сообщений
+from tempfiles import temp_files
+
 # Импорт констант приложения
 from constants import (
     SPEED_OPTIONS, DEFAULT_SOURCE_LANGUAGE, DEFAULT_LANGUAGE, DEFAULT_SPEED,
@@ -34,6 +37,9 @@ logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Количество потоков, в которых параллельно обрабатываются сообщения разных пользователей
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', 16))
+
 def main():
     """Главная функция для запуска бота."""
     # Проверка наличия переменной окружения с токеном
@@ -49,10 +55,10 @@ def main():
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         
         from constants import SPEED_OPTIONS, DEFAULT_SOURCE_LANGUAGE, DEFAULT_LANGUAGE, DEFAULT_SPEED
-        from translator import translate_text, get_available_languages
-        from text_to_speech import text_to_speech, adjust_audio_speed
+        from translator import translate_text, translate_many, get_available_languages
+        from text_to_speech import text_to_speech_streamed, adjust_audio_speed
         from ocr import extract_text_from_image
-        from user_preferences import UserPreferences
+        from user_preferences import get_prefs
     except ImportError as e:
         logger.error(f"Ошибка импорта: {e}")
         print(f"\033[91mОшибка при импорте модулей: {e}\033[0m")
@@ -60,24 +66,19 @@ def main():
         print("pip install python-telegram-bot==13.15 deep-translator gtts pydub pytesseract pillow")
         return 1
 
-    # Словарь для хранения пользовательских настроек
-    # Теперь настройки сохраняются между сессиями в базе данных
-    user_prefs = {}
-    
     # Словарь для хранения групп изображений
     # Структура: {media_group_id: {'user_id': user_id, 'images': [], 'message_id': None}
     media_groups = {}
+    # Изображения одной группы могут обрабатываться в разных потоках
+    media_groups_lock = threading.Lock()
 
     # Обработчики команд
     def start_command(update, context):
         """Обрабатывает команду /start."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            # UserPreferences теперь загружает настройки из базы данных
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
         
         # Создаем красивое главное меню с кнопками
         keyboard = [
@@ -141,11 +142,8 @@ def main():
         """Обрабатывает команду /settings."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            # UserPreferences теперь загружает настройки из базы данных
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        prefs = get_prefs(user_id)
         
         keyboard = [
             [InlineKeyboardButton("🔍 Изменить исходный язык", callback_data="show_source_languages")],
@@ -163,10 +161,10 @@ def main():
             'pt': '🇵🇹', 'tr': '🇹🇷', 'hi': '🇮🇳', 'nl': '🇳🇱', 'pl': '🇵🇱'
         }
         
-        language_code = user_prefs[user_id].language
+        language_code = prefs.language
         language_emoji = language_emojis.get(language_code, '🌐')
         
-        audio_language_code = user_prefs[user_id].audio_language
+        audio_language_code = prefs.audio_language
         audio_language_emoji = language_emojis.get(audio_language_code, '🎧')
         
         # Получаем эмодзи для скорости
@@ -178,14 +176,14 @@ def main():
             1.5: "🏎️", 
             2.0: "🚀"
         }
-        speed = user_prefs[user_id].speed
+        speed = prefs.speed
         speed_emoji = speed_emojis.get(speed, "🔊")
         
         current_settings = (
             f"⚙️ *Настройки {APP_NAME}*\n\n"
-            f"{language_emoji} *Язык перевода:* {user_prefs[user_id].language_name}\n"
-            f"{audio_language_emoji} *Язык озвучивания:* {user_prefs[user_id].audio_language_name}\n"
-            f"{speed_emoji} *Скорость речи:* {user_prefs[user_id].speed}x\n\n"
+            f"{language_emoji} *Язык перевода:* {prefs.language_name}\n"
+            f"{audio_language_emoji} *Язык озвучивания:* {prefs.audio_language_name}\n"
+            f"{speed_emoji} *Скорость речи:* {prefs.speed}x\n\n"
             f"Выберите опцию для изменения:"
         )
         
@@ -200,10 +198,8 @@ def main():
         """Обрабатывает команду /language."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
             
         show_language_options(update, context)
 
@@ -211,10 +207,8 @@ def main():
         """Обрабатывает команду /speed."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
             
         show_speed_options(update, context)
         
@@ -222,10 +216,8 @@ def main():
         """Обрабатывает команду /source_language."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
             
         show_source_language_options(update, context)
         
@@ -233,10 +225,8 @@ def main():
         """Обрабатывает команду /audio_language."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
             
         show_audio_language_options(update, context)
         
@@ -244,10 +234,8 @@ def main():
         """Обрабатывает команду /voice_type."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
             
         show_voice_type_options(update, context)
 
@@ -569,10 +557,8 @@ def main():
         
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        prefs = get_prefs(user_id)
         
         callback_data = query.data
         
@@ -777,29 +763,29 @@ def main():
                 "normal": "🔊", "slow": "🐢", "clear": "🔍", "emotional": "😀"
             }
             
-            source_language_code = user_prefs[user_id].source_language
+            source_language_code = prefs.source_language
             source_language_emoji = '🔍' if source_language_code == 'auto' else language_emojis.get(source_language_code, '🌐')
             
-            language_code = user_prefs[user_id].language
+            language_code = prefs.language
             language_emoji = language_emojis.get(language_code, '🌐')
             
-            audio_language_code = user_prefs[user_id].audio_language
+            audio_language_code = prefs.audio_language
             audio_language_emoji = language_emojis.get(audio_language_code, '🎧')
             
-            speed = user_prefs[user_id].speed
+            speed = prefs.speed
             speed_emoji = speed_emojis.get(speed, "🔊")
             
             # Получаем тип голоса и соответствующую иконку
-            voice_type = user_prefs[user_id].voice_type
+            voice_type = prefs.voice_type
             voice_emoji = voice_type_emojis.get(voice_type, "🎤")
             
             current_settings = (
                 f"⚙️ *Настройки {APP_NAME}*\n\n"
-                f"{source_language_emoji} *Исходный язык:* {user_prefs[user_id].source_language_name}\n"
-                f"{language_emoji} *Язык перевода:* {user_prefs[user_id].language_name}\n"
-                f"{audio_language_emoji} *Язык озвучивания:* {user_prefs[user_id].audio_language_name}\n"
-                f"{voice_emoji} *Тип голоса:* {user_prefs[user_id].voice_type_name}\n"
-                f"{speed_emoji} *Скорость речи:* {user_prefs[user_id].speed}x\n\n"
+                f"{source_language_emoji} *Исходный язык:* {prefs.source_language_name}\n"
+                f"{language_emoji} *Язык перевода:* {prefs.language_name}\n"
+                f"{audio_language_emoji} *Язык озвучивания:* {prefs.audio_language_name}\n"
+                f"{voice_emoji} *Тип голоса:* {prefs.voice_type_name}\n"
+                f"{speed_emoji} *Скорость речи:* {prefs.speed}x\n\n"
                 f"Выберите опцию для изменения:"
             )
             
@@ -824,7 +810,7 @@ def main():
                     language_name = source_language_code.upper()
             
             # Обновляем настройки пользователя
-            user_prefs[user_id].update_source_language(source_language_code)
+            prefs.update_source_language(source_language_code)
             
             # Эмодзи для языка
             language_emojis = {
@@ -855,7 +841,7 @@ def main():
                 # Если язык не найден в списке, используем код языка с заглавной буквы
                 language_name = language_code.upper()
             
-            user_prefs[user_id].update_language(language_code)
+            prefs.update_language(language_code)
             
             # Словарь для популярных языков и их эмодзи
             language_emojis = {
@@ -877,7 +863,7 @@ def main():
         elif callback_data.startswith("audio_lang_"):
             # Установка языка озвучивания
             language_code = callback_data[11:]
-            user_prefs[user_id].update_audio_language(language_code)
+            prefs.update_audio_language(language_code)
             
             # Словарь для популярных языков и их эмодзи
             language_emojis = {
@@ -890,7 +876,7 @@ def main():
             
             query.edit_message_text(
                 f"✅ *Настройки обновлены*\n\n"
-                f"Язык озвучивания: {flag_emoji} *{user_prefs[user_id].audio_language_name}*\n\n"
+                f"Язык озвучивания: {flag_emoji} *{prefs.audio_language_name}*\n\n"
                 f"📝 Отправьте мне текст или изображение для обработки.",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад к настройкам", callback_data="back_to_settings")]])
@@ -899,7 +885,7 @@ def main():
         elif callback_data.startswith("speed_"):
             # Установка скорости
             speed = float(callback_data[6:])
-            user_prefs[user_id].update_speed(speed)
+            prefs.update_speed(speed)
             
             # Эмодзи для скорости
             speed_emojis = {
@@ -929,7 +915,7 @@ def main():
         elif callback_data.startswith("voice_"):
             # Установка типа голоса
             voice_type = callback_data[6:]
-            user_prefs[user_id].update_voice_type(voice_type)
+            prefs.update_voice_type(voice_type)
             
             # Эмодзи для типов голосов
             voice_type_emojis = {
@@ -943,7 +929,7 @@ def main():
             
             query.edit_message_text(
                 f"✅ *Настройки обновлены*\n\n"
-                f"Тип голоса: {voice_emoji} *{user_prefs[user_id].voice_type_name}*\n\n"
+                f"Тип голоса: {voice_emoji} *{prefs.voice_type_name}*\n\n"
                 f"📝 Отправьте мне текст или изображение для обработки.",
                 parse_mode='Markdown',
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад к настройкам", callback_data="back_to_settings")]])
@@ -954,48 +940,52 @@ def main():
         user_id = update.effective_user.id
         message = update.message
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        get_prefs(user_id)
         
         # Если изображение является частью группы
         if message.media_group_id:
             media_group_id = message.media_group_id
             
-            # Инициализируем группу, если она еще не существует
-            if media_group_id not in media_groups:
-                media_groups[media_group_id] = {
-                    'user_id': user_id,
-                    'images': [],
-                    'message_id': None
-                }
-                # Сообщение об обработке
+            # Получаем файл изображения
+            photo = message.photo[-1]  # Берем самую большую версию
+            
+            with media_groups_lock:
+                # Инициализируем группу, если она еще не существует
+                media_group = media_groups.get(media_group_id)
+                is_new_group = media_group is None
+                if is_new_group:
+                    media_group = media_groups[media_group_id] = {
+                        'user_id': user_id,
+                        'images': [],
+                        'message_id': None
+                    }
+                
+                # Добавляем изображение в группу
+                media_group['images'].append(photo)
+                
+                # Планируем обработку группы изображений через 2 секунды после последнего изображения
+                # Это нужно, чтобы дождаться все изображения в группе
+                previous_job = media_group.get('job')
+                if previous_job:
+                    previous_job.schedule_removal()
+                
+                # Создаем новую задачу
+                media_group['job'] = context.job_queue.run_once(
+                    process_media_group,
+                    2,  # Задержка 2 секунды
+                    context=(media_group_id, context.bot, update.effective_chat.id)
+                )
+            
+            if is_new_group:
+                # Сообщение об обработке (сетевой запрос, поэтому вне блокировки)
                 processing_message = update.message.reply_text(
                     "🔍 *Получаю группу изображений...*\n\n"
                     "⏳ Пожалуйста, подождите, пока все изображения будут загружены...",
                     parse_mode='Markdown'
                 )
-                media_groups[media_group_id]['message_id'] = processing_message.message_id
-
-            # Получаем файл изображения
-            photo = message.photo[-1]  # Берем самую большую версию
-            
-            # Добавляем изображение в группу
-            media_groups[media_group_id]['images'].append(photo)
-            
-            # Планируем обработку группы изображений через 2 секунды после последнего изображения
-            # Это нужно, чтобы дождаться все изображения в группе
-            if 'job' in media_groups[media_group_id]:
-                context.job_queue.scheduler.remove_job(media_groups[media_group_id]['job'].id)
-            
-            # Создаем новую задачу
-            job = context.job_queue.run_once(
-                process_media_group,
-                2,  # Задержка 2 секунды
-                context=(media_group_id, context.bot, update.effective_chat.id)
-            )
-            media_groups[media_group_id]['job'] = job
+                with media_groups_lock:
+                    media_group['message_id'] = processing_message.message_id
             return True
             
         return False
@@ -1005,14 +995,22 @@ def main():
         job = context.job
         media_group_id, bot, chat_id = job.context
         
-        # Проверяем, существует ли группа
-        if media_group_id not in media_groups:
-            return
+        # Забираем группу из словаря: изображения, пришедшие позже, попадут в новую группу
+        with media_groups_lock:
+            media_group = media_groups.pop(media_group_id, None)
+            if media_group is None:
+                return
+            user_id = media_group['user_id']
+            message_id = media_group['message_id']
+            images = list(media_group['images'])
         
-        media_group = media_groups[media_group_id]
-        user_id = media_group['user_id']
-        message_id = media_group['message_id']
-        images = media_group['images']
+        # Сообщение о получении группы еще не успело отправиться - создаем свое
+        if message_id is None:
+            message_id = bot.send_message(
+                chat_id=chat_id,
+                text="🔍 *Получаю группу изображений...*",
+                parse_mode='Markdown'
+            ).message_id
         
         # Обновляем сообщение об обработке
         bot.edit_message_text(
@@ -1025,6 +1023,8 @@ def main():
         )
         
         all_texts = []
+        # Распознанные тексты для перевода: (позиция в all_texts, номер изображения, текст)
+        recognized_texts = []
         failed_images = 0
         
         # Обрабатываем каждое изображение
@@ -1032,20 +1032,16 @@ def main():
             try:
                 file = bot.get_file(photo.file_id)
                 
-                # Создаем временный файл для загрузки изображения
-                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                    temp_path = temp_file.name
-                
-                # Загружаем изображение
-                file.download(temp_path)
-                
-                # Извлекаем текст
-                extracted_text = extract_text_from_image(temp_path)
-                
-                # Удаляем временный файл
-                os.unlink(temp_path)
+                # Берем временный файл из пула для загрузки изображения
+                with temp_files.path('.jpg') as temp_path:
+                    # Загружаем изображение
+                    file.download(temp_path)
+                    
+                    # Извлекаем текст
+                    extracted_text = extract_text_from_image(temp_path)
                 
                 if extracted_text:
+                    recognized_texts.append((len(all_texts), i, extracted_text))
                     all_texts.append(f"📄 *Изображение {i+1}:*\n{extracted_text}")
                 else:
                     failed_images += 1
@@ -1067,13 +1063,12 @@ def main():
                      "📸 Пожалуйста, убедитесь что изображения четкие и содержат текст.",
                 parse_mode='Markdown'
             )
-            # Удаляем группу из словаря
-            del media_groups[media_group_id]
             return
         
         # Переводим весь текст
-        language = user_prefs[user_id].language
-        source_language = user_prefs[user_id].source_language
+        prefs = get_prefs(user_id)
+        language = prefs.language
+        source_language = prefs.source_language
         
         # Обновляем сообщение - перевод
         bot.edit_message_text(
@@ -1101,7 +1096,14 @@ def main():
         
         # Если исходный язык отличается от целевого, выполняем перевод
         if language != "auto" and (source_language == "auto" or source_language != language):
-            translated_text = translate_text(combined_text, language, source_language)
+            # Переводим тексты всех изображений вместе, без заголовков
+            translations = translate_many(
+                [text for _, _, text in recognized_texts], language, source_language
+            )
+            translated_texts = list(all_texts)
+            for (position, i, _), translation in zip(recognized_texts, translations):
+                translated_texts[position] = f"📄 *Изображение {i+1}:*\n{translation}"
+            translated_text = "\n\n".join(translated_texts)
             
             # Добавляем информацию о переводе
             source_language_emoji = '🔍' if source_language == 'auto' else language_emojis.get(source_language, '🌐')
@@ -1110,7 +1112,7 @@ def main():
             if translated_text != combined_text:
                 translation_info = (
                     f"\n\n{source_language_emoji} → {language_emoji} *Текст переведен с "
-                    f"{user_prefs[user_id].source_language_name} на {user_prefs[user_id].language_name}*"
+                    f"{prefs.source_language_name} на {prefs.language_name}*"
                 )
                 # Сохраняем оригинальный текст для кнопки копирования
                 context.bot_data[f"copy_text_{text_id}"] = combined_text
@@ -1141,9 +1143,6 @@ def main():
             parse_mode='Markdown',
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
-        
-        # Удаляем группу из словаря
-        del media_groups[media_group_id]
 
     def handle_image(update, context):
         """Обрабатывает изображения, отправленные пользователем."""
@@ -1155,10 +1154,8 @@ def main():
             if handled:
                 return
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        prefs = get_prefs(user_id)
         
         # Сообщение об обработке с анимированным эмодзи
         processing_message = update.message.reply_text("🔍 *Обработка вашего изображения...*\n\n" \
@@ -1171,25 +1168,20 @@ def main():
             photo = update.message.photo[-1]  # Берем самую большую версию
             file = context.bot.get_file(photo.file_id)
             
-            # Создаем временный файл для загрузки изображения
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                temp_path = temp_file.name
-            
-            # Загружаем изображение
-            file.download(temp_path)
-            
-            # Извлекаем текст
-            extracted_text = extract_text_from_image(temp_path)
-            
-            # Удаляем временный файл
-            os.unlink(temp_path)
+            # Берем временный файл из пула для загрузки изображения
+            with temp_files.path('.jpg') as temp_path:
+                # Загружаем изображение
+                file.download(temp_path)
+                
+                # Извлекаем текст
+                extracted_text = extract_text_from_image(temp_path)
             
             if not extracted_text:
                 processing_message.edit_text("❌ Извините, не удалось извлечь текст из этого изображения. Пожалуйста, попробуйте с более четким изображением.")
                 return
             
             # Язык перевода
-            language = user_prefs[user_id].language
+            language = prefs.language
             
             # Отправляем извлеченный текст с красивым форматированием и кнопкой для копирования
             # Создаем копируемую версию текста (без маркдауна для идеального копирования)
@@ -1212,7 +1204,7 @@ def main():
             )
             
             # Переводим текст
-            source_language = user_prefs[user_id].source_language
+            source_language = prefs.source_language
             translated_text = translate_text(extracted_text, language, source_language)
             
             # Отправляем перевод с красивым форматированием, если он отличается от оригинала
@@ -1235,21 +1227,21 @@ def main():
                 context.user_data[f"copy_tr_{user_id}"] = translated_text
                 
                 # Получаем эмодзи для исходного языка
-                source_language_code = user_prefs[user_id].source_language
+                source_language_code = prefs.source_language
                 source_language_emoji = '🔍' if source_language_code == 'auto' else language_emojis.get(source_language_code, '🌐')
                 
                 update.message.reply_text(
                     f"🌐 *Перевод выполнен!*\n\n"
-                    f"{source_language_emoji} *Исходный язык: {user_prefs[user_id].source_language_name}*\n"
-                    f"{flag_emoji} *Язык перевода: {user_prefs[user_id].language_name}*\n"
+                    f"{source_language_emoji} *Исходный язык: {prefs.source_language_name}*\n"
+                    f"{flag_emoji} *Язык перевода: {prefs.language_name}*\n"
                     f"```\n{translated_text}\n```",
                     parse_mode='Markdown',
                     reply_markup=InlineKeyboardMarkup(copy_tr_keyboard)
                 )
             
             # Генерируем аудио с информацией о процессе
-            speed = user_prefs[user_id].speed
-            audio_language = user_prefs[user_id].audio_language
+            speed = prefs.speed
+            audio_language = prefs.audio_language
             
             # Эмодзи для скорости
             speed_emojis = {
@@ -1267,7 +1259,7 @@ def main():
             audio_language_emoji = language_emojis.get(audio_language, '🎧')
             
             # Эмодзи для типа голоса
-            voice_type = user_prefs[user_id].voice_type
+            voice_type = prefs.voice_type
             voice_type_emojis = {
                 "normal": "🔊",
                 "slow": "🐢",
@@ -1279,33 +1271,28 @@ def main():
             audio_msg = update.message.reply_text(
                 f"🎵 *Генерация аудиофайла*\n\n"
                 f"{speed_emoji} Скорость: *{speed}x*\n"
-                f"{audio_language_emoji} Язык озвучивания: *{user_prefs[user_id].audio_language_name}*\n"
-                f"{voice_emoji} Тип голоса: *{user_prefs[user_id].voice_type_name}*\n\n"
+                f"{audio_language_emoji} Язык озвучивания: *{prefs.audio_language_name}*\n"
+                f"{voice_emoji} Тип голоса: *{prefs.voice_type_name}*\n\n"
                 f"⏳ Пожалуйста, подождите...",
                 parse_mode='Markdown'
             )
             
             # Используем язык озвучивания вместо языка перевода
-            voice_type = user_prefs[user_id].voice_type
-            audio_path = text_to_speech(translated_text, audio_language, voice_type)
-            adjusted_audio_path = adjust_audio_speed(audio_path, speed)
+            voice_type = prefs.voice_type
+            audio = text_to_speech_streamed(translated_text, audio_language, voice_type)
+            adjusted_audio = adjust_audio_speed(audio, speed)
             
             # Отправляем аудио с информативной подписью
-            with open(adjusted_audio_path, 'rb') as audio:
-                # Создаем подпись к аудио
-                audio_caption = (
-                    f"🎧 *Аудио готово!*\n"
-                    f"{speed_emoji} Скорость: *{speed}x*\n"
-                    f"{audio_language_emoji} Язык озвучивания: *{user_prefs[user_id].audio_language_name}*"
-                )
-                
-                # Отправляем аудио и удаляем сообщение о генерации
-                update.message.reply_voice(audio, caption=audio_caption, parse_mode='Markdown')
-                audio_msg.delete()
+            # Создаем подпись к аудио
+            audio_caption = (
+                f"🎧 *Аудио готово!*\n"
+                f"{speed_emoji} Скорость: *{speed}x*\n"
+                f"{audio_language_emoji} Язык озвучивания: *{prefs.audio_language_name}*"
+            )
             
-            # Удаляем временные файлы
-            os.unlink(audio_path)
-            os.unlink(adjusted_audio_path)
+            # Отправляем аудио и удаляем сообщение о генерации
+            update.message.reply_voice(adjusted_audio, caption=audio_caption, parse_mode='Markdown')
+            audio_msg.delete()
         
         except Exception as e:
             logger.error(f"Ошибка при обработке изображения: {e}")
@@ -1325,10 +1312,8 @@ def main():
         message_id = update.message.message_id
         voice = update.message.voice
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        prefs = get_prefs(user_id)
         
         # Создаем сообщение о начале обработки
         processing_message = update.message.reply_text(
@@ -1336,17 +1321,17 @@ def main():
             reply_to_message_id=message_id
         )
         
+        voice_file_path = None
         try:
             # Скачиваем голосовое сообщение
             file = context.bot.get_file(voice.file_id)
             
-            # Создаем временный файл для сохранения голосового сообщения
-            voice_file = tempfile.NamedTemporaryFile(delete=False, suffix='.ogg')
-            voice_file.close()
+            # Берем временный файл из пула для сохранения голосового сообщения
+            voice_file_path = temp_files.acquire('.ogg')
             
             # Скачиваем файл
-            file.download(voice_file.name)
-            logger.info(f"Скачан голосовой файл: {voice_file.name}")
+            file.download(voice_file_path)
+            logger.info(f"Скачан голосовой файл: {voice_file_path}")
             
             # Импортируем функцию преобразования речи в текст
             from speech_to_text import speech_to_text
@@ -1358,7 +1343,7 @@ def main():
                 text="🔍 Распознаю речь..."
             )
             
-            transcribed_text = speech_to_text(voice_file.name)
+            transcribed_text = speech_to_text(voice_file_path)
             
             # Если текст пустой, сообщаем об ошибке
             if not transcribed_text:
@@ -1378,11 +1363,11 @@ def main():
             
             # Обрабатываем распознанный текст как обычное текстовое сообщение
             # Получаем настройки пользователя
-            target_language = user_prefs[user_id].language
-            source_language = user_prefs[user_id].source_language
-            audio_language = user_prefs[user_id].audio_language
-            voice_type = user_prefs[user_id].voice_type
-            speed = user_prefs[user_id].speed
+            target_language = prefs.language
+            source_language = prefs.source_language
+            audio_language = prefs.audio_language
+            voice_type = prefs.voice_type
+            speed = prefs.speed
             
             # Переводим текст если нужно
             if source_language != target_language:
@@ -1396,42 +1381,34 @@ def main():
                     )
                     
                     # Создаем аудио из переведенного текста
-                    audio_path = text_to_speech(translated_text, audio_language, voice_type)
+                    audio = text_to_speech_streamed(translated_text, audio_language, voice_type)
                     
                     # Настраиваем скорость речи
                     if speed != 1.0:
-                        audio_path = adjust_audio_speed(audio_path, speed)
+                        audio = adjust_audio_speed(audio, speed)
                     
                     # Отправляем аудио
-                    with open(audio_path, 'rb') as audio:
-                        update.message.reply_voice(
-                            audio,
-                            caption=f"🔊 Озвучивание перевода ({user_prefs[user_id].audio_language_name}, {speed}x)",
-                            reply_to_message_id=message_id
-                        )
-                    
-                    # Удаляем временный файл
-                    os.remove(audio_path)
+                    update.message.reply_voice(
+                        audio,
+                        caption=f"🔊 Озвучивание перевода ({prefs.audio_language_name}, {speed}x)",
+                        reply_to_message_id=message_id
+                    )
             
             # Предлагаем озвучить исходный текст, если не было перевода
             else:
                 # Создаем аудио из исходного текста с другим голосом
-                audio_path = text_to_speech(transcribed_text, audio_language, voice_type)
+                audio = text_to_speech_streamed(transcribed_text, audio_language, voice_type)
                 
                 # Настраиваем скорость речи
                 if speed != 1.0:
-                    audio_path = adjust_audio_speed(audio_path, speed)
+                    audio = adjust_audio_speed(audio, speed)
                 
                 # Отправляем аудио
-                with open(audio_path, 'rb') as audio:
-                    update.message.reply_voice(
-                        audio,
-                        caption=f"🔊 Озвучивание текста ({user_prefs[user_id].audio_language_name}, {speed}x)",
-                        reply_to_message_id=message_id
-                    )
-                
-                # Удаляем временный файл
-                os.remove(audio_path)
+                update.message.reply_voice(
+                    audio,
+                    caption=f"🔊 Озвучивание текста ({prefs.audio_language_name}, {speed}x)",
+                    reply_to_message_id=message_id
+                )
                 
         except Exception as e:
             logger.error(f"Ошибка при обработке голосового сообщения: {e}")
@@ -1441,19 +1418,16 @@ def main():
                 text=f"❌ Произошла ошибка при обработке голосового сообщения. Попробуйте еще раз."
             )
         finally:
-            # Удаляем временный файл голосового сообщения
-            voice_file_path = getattr(voice_file, 'name', None) if 'voice_file' in locals() else None
-            if voice_file_path and os.path.exists(voice_file_path):
-                os.remove(voice_file_path)
+            # Возвращаем временный файл голосового сообщения в пул
+            if voice_file_path:
+                temp_files.release(voice_file_path)
     
     def handle_text(update, context):
         """Обрабатывает текстовые сообщения."""
         user_id = update.effective_user.id
         
-        # Загружаем настройки пользователя из базы данных
-        if user_id not in user_prefs:
-            user_prefs[user_id] = UserPreferences(user_id)
-            logger.info(f"Загружены настройки пользователя {user_id} из базы данных")
+        # Получаем настройки пользователя (из памяти или из базы данных)
+        prefs = get_prefs(user_id)
         
         # Получаем текст
         text = update.message.text
@@ -1473,8 +1447,8 @@ def main():
         
         try:
             # Перевод текста
-            language = user_prefs[user_id].language
-            source_language = user_prefs[user_id].source_language
+            language = prefs.language
+            source_language = prefs.source_language
             translated_text = translate_text(text, language, source_language)
             
             # Отправляем перевод с красивым форматированием
@@ -1489,14 +1463,14 @@ def main():
             flag_emoji = language_emojis.get(language, '🌐')
             
             # Получаем эмодзи для исходного языка
-            source_language_code = user_prefs[user_id].source_language
+            source_language_code = prefs.source_language
             source_language_emoji = '🔍' if source_language_code == 'auto' else language_emojis.get(source_language_code, '🌐')
             
             if translated_text != text:
                 processing_message.edit_text(
                     f"🌐 *Перевод выполнен!*\n\n"
-                    f"{source_language_emoji} *Исходный язык: {user_prefs[user_id].source_language_name}*\n"
-                    f"{flag_emoji} *Язык перевода: {user_prefs[user_id].language_name}*\n"
+                    f"{source_language_emoji} *Исходный язык: {prefs.source_language_name}*\n"
+                    f"{flag_emoji} *Язык перевода: {prefs.language_name}*\n"
                     f"```\n{translated_text}\n```\n\n"
                     f"🎵 *Генерирую аудиоверсию...*",
                     parse_mode='Markdown'
@@ -1504,19 +1478,19 @@ def main():
             else:
                 processing_message.edit_text(
                     f"✅ *Обработка завершена*\n\n"
-                    f"{source_language_emoji} *Исходный язык: {user_prefs[user_id].source_language_name}*\n"
-                    f"{flag_emoji} *Язык текста: {user_prefs[user_id].language_name}*\n"
+                    f"{source_language_emoji} *Исходный язык: {prefs.source_language_name}*\n"
+                    f"{flag_emoji} *Язык текста: {prefs.language_name}*\n"
                     f"🎵 *Генерирую аудиоверсию...*",
                     parse_mode='Markdown'
                 )
             
             # Генерируем аудио
-            speed = user_prefs[user_id].speed
-            audio_language = user_prefs[user_id].audio_language
+            speed = prefs.speed
+            audio_language = prefs.audio_language
             
             # Уведомление о генерации аудио
             # Получаем тип голоса и соответствующую иконку
-            voice_type = user_prefs[user_id].voice_type
+            voice_type = prefs.voice_type
             voice_type_emojis = {
                 "normal": "🔊",
                 "slow": "🐢",
@@ -1528,16 +1502,16 @@ def main():
             audio_msg = update.message.reply_text(
                 f"🎵 *Генерация аудиофайла*\n\n"
                 f"⚙️ Скорость: *{speed}x*\n"
-                f"🔊 Язык озвучивания: *{user_prefs[user_id].audio_language_name}*\n"
-                f"{voice_emoji} Тип голоса: *{user_prefs[user_id].voice_type_name}*\n\n"
+                f"🔊 Язык озвучивания: *{prefs.audio_language_name}*\n"
+                f"{voice_emoji} Тип голоса: *{prefs.voice_type_name}*\n\n"
                 f"⏳ Пожалуйста, подождите...",
                 parse_mode='Markdown'
             )
             
             # Используем язык озвучивания вместо языка перевода
-            voice_type = user_prefs[user_id].voice_type
-            audio_path = text_to_speech(translated_text, audio_language, voice_type)
-            adjusted_audio_path = adjust_audio_speed(audio_path, speed)
+            voice_type = prefs.voice_type
+            audio = text_to_speech_streamed(translated_text, audio_language, voice_type)
+            adjusted_audio = adjust_audio_speed(audio, speed)
             
             # Отправляем аудио с информативной подписью
             
@@ -1554,22 +1528,17 @@ def main():
             # Получаем эмодзи для типа голоса
             voice_emoji = voice_type_emojis.get(voice_type, "🎤")
             
-            with open(adjusted_audio_path, 'rb') as audio:
-                # Создаем подпись к аудио
-                audio_caption = (
-                    f"🎧 *Аудио готово!*\n"
-                    f"{speed_emoji} Скорость: *{speed}x*\n"
-                    f"{audio_language_emoji} Язык озвучивания: *{user_prefs[user_id].audio_language_name}*\n"
-                    f"{voice_emoji} Тип голоса: *{user_prefs[user_id].voice_type_name}*"
-                )
-                
-                # Отправляем аудио и удаляем уведомление о генерации
-                update.message.reply_voice(audio, caption=audio_caption, parse_mode='Markdown')
-                audio_msg.delete()
+            # Создаем подпись к аудио
+            audio_caption = (
+                f"🎧 *Аудио готово!*\n"
+                f"{speed_emoji} Скорость: *{speed}x*\n"
+                f"{audio_language_emoji} Язык озвучивания: *{prefs.audio_language_name}*\n"
+                f"{voice_emoji} Тип голоса: *{prefs.voice_type_name}*"
+            )
             
-            # Удаляем временные файлы
-            os.unlink(audio_path)
-            os.unlink(adjusted_audio_path)
+            # Отправляем аудио и удаляем уведомление о генерации
+            update.message.reply_voice(adjusted_audio, caption=audio_caption, parse_mode='Markdown')
+            audio_msg.delete()
         
         except Exception as e:
             logger.error(f"Ошибка при обработке текста: {e}")
@@ -1586,7 +1555,7 @@ def main():
     if not token:
         print("\033[91mОШИБКА: TELEGRAM_BOT_TOKEN не установлен!\033[0m")
         return 1
-    updater = Updater(token=token, use_context=True)
+    updater = Updater(token=token, use_context=True, workers=BOT_WORKERS)
     dispatcher = updater.dispatcher
     
     # Добавляем обработчики команд
@@ -1603,9 +1572,11 @@ def main():
     dispatcher.add_handler(CallbackQueryHandler(handle_button))
     
     # Добавляем обработчики сообщений
-    dispatcher.add_handler(MessageHandler(Filters.photo, handle_image))
-    dispatcher.add_handler(MessageHandler(Filters.voice, handle_voice))
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text))
+    # Они ждут OCR, распознавания речи и сетевых запросов к переводчику и TTS,
+    # поэтому выполняются в пуле потоков и не задерживают сообщения других пользователей
+    dispatcher.add_handler(MessageHandler(Filters.photo, handle_image, run_async=True))
+    dispatcher.add_handler(MessageHandler(Filters.voice, handle_voice, run_async=True))
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text, run_async=True))
     
     # Запускаем бота
     print("\033[92m┌─────────────────────────────────────────┐\033[0m")
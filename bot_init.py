@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Скрипт для однократной инициализации базы данных (создания таблиц).
+Удобно запускать из CI или entrypoint контейнера перед стартом бота.
+"""
+import sys
+import logging
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+from database import init_db
+
+if __name__ == "__main__":
+    init_db()
+    sys.exit(0)
@@ -3,18 +3,23 @@ Database module for connecting to the database and managing session.
 """
 import os
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import threading
+from functools import lru_cache
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import SQLAlchemyError
 
+from cache import TTLCache
 from models import Base, UserSettings
 from constants import (
     DEFAULT_SOURCE_LANGUAGE, DEFAULT_LANGUAGE, DEFAULT_AUDIO_LANGUAGE, 
-    DEFAULT_VOICE_TYPE, DEFAULT_SPEED,
+    DEFAULT_VOICE_TYPE, DEFAULT_SPEED, SPEED_OPTIONS,
     VOICE_TYPES, AVAILABLE_AUDIO_LANGUAGES
 )
-from translator import get_available_languages
+from translator import COMMON_LANGUAGES
 
 # Логгер
 logger = logging.getLogger(__name__)
@@ -28,15 +33,88 @@ if not DATABASE_URL:
     logger.warning("DATABASE_URL not set or empty, using SQLite database instead")
     DATABASE_URL = "sqlite:///bot.db"
 
+# Настройки SQLite для каждого нового соединения:
+# WAL позволяет читать во время записи, а busy_timeout ждет блокировку вместо ошибки SQLITE_BUSY
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Apply SQLITE_PRAGMAS to a new SQLite connection.
+    
+    Args:
+        dbapi_connection: sqlite3 connection opened by the pool
+        connection_record: Pool record of the connection (unused)
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 # Создание движка SQLAlchemy
-engine = create_engine(DATABASE_URL)
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite: разрешаем использовать соединения из разных потоков обработчиков
+    engine_options = {"connect_args": {"check_same_thread": False, "timeout": 5}}
+    if DATABASE_URL in ("sqlite://", "sqlite:///:memory:"):
+        # База в памяти существует только в рамках одного соединения
+        engine_options["poolclass"] = StaticPool
+else:
+    # Пул соединений с проверкой живости и периодическим пересозданием,
+    # чтобы не получать OperationalError на соединениях, закрытых сервером
+    engine_options = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 20)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 40)),
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
+engine = create_engine(DATABASE_URL, **engine_options)
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
+# Создание сессии (одна сессия на поток, общий пул соединений)
+Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+
+# Диалекты, поддерживающие INSERT ... ON CONFLICT DO NOTHING
+_INSERT_IGNORE_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Настройки, которые пользователь может менять
+EDITABLE_SETTINGS = frozenset({"source_language", "language", "audio_language", "voice_type", "speed"})
 
-# Создание сессии
-Session = sessionmaker(bind=engine)
+# Кэш настроек пользователей: настройки читаются на каждое сообщение, а меняются редко.
+# USER_SETTINGS_CACHE_TTL=0 отключает кэш
+USER_SETTINGS_CACHE_TTL = float(os.environ.get("USER_SETTINGS_CACHE_TTL", 300))
+_settings_cache = TTLCache(maxsize=10_000, ttl=USER_SETTINGS_CACHE_TTL)
+# Блокировки загрузки настроек (по хэшу user_id), чтобы параллельные
+# обработчики одного пользователя не запрашивали базу данных одновременно
+_settings_load_locks = tuple(threading.Lock() for _ in range(64))
+
+def invalidate_user_settings(user_id):
+    """
+    Drop cached settings of a user so the next read goes to the database.
+    
+    Args:
+        user_id: User ID from Telegram
+    """
+    _settings_cache.pop(str(user_id), None)
 
+@lru_cache(maxsize=1)
 def init_db():
     """
     Initialize the database by creating all tables.
+    
+    Only the first successful call in a process touches the database,
+    repeated calls are no-ops.
     """
     try:
         Base.metadata.create_all(engine)
@@ -45,9 +123,28 @@ def init_db():
         logger.error(f"Error creating database tables: {e}")
         raise
 
+def _insert_ignore_statement(values):
+    """
+    Build an INSERT that silently skips rows whose user_id already exists.
+    
+    Args:
+        values: Column values of the new row
+        
+    Returns:
+        Insert statement, or None if the dialect has no ON CONFLICT support
+    """
+    dialect_insert = _INSERT_IGNORE_DIALECTS.get(engine.dialect.name)
+    if dialect_insert is None:
+        return None
+    return dialect_insert(UserSettings).values(**values).on_conflict_do_nothing(
+        index_elements=["user_id"]
+    )
+
 def get_or_create_user_settings(user_id):
     """
-    Get user settings from the database, or create them if they don't exist.
+    Get user settings from the cache or the database, or create them if they don't exist.
+    
+    Concurrent calls for the same user wait for a single database query.
     
     Args:
         user_id: User ID from Telegram
@@ -55,131 +152,235 @@ def get_or_create_user_settings(user_id):
     Returns:
         UserSettings object with the user's preferences
     """
-    session = Session()
-    try:
-        # Пытаемся получить настройки пользователя из базы данных
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
+    key = str(user_id)
+    cached = _settings_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    with _settings_load_locks[hash(key) % len(_settings_load_locks)]:
+        # Пока ждали блокировку, настройки мог загрузить другой обработчик
+        cached = _settings_cache.get(key)
+        if cached is not None:
+            return cached
+        settings = _load_user_settings(user_id)
+        _settings_cache.set(key, settings)
+        return settings
+
+def _load_user_settings(user_id):
+    """
+    Get user settings from the database, or create them if they don't exist.
+    
+    Args:
+        user_id: User ID from Telegram
         
-        # Если настройки не найдены, создаем новые
-        if not settings:
-            # Получаем имена языков
-            language_name = get_available_languages().get(DEFAULT_LANGUAGE)
-            if not language_name:
-                language_name = DEFAULT_LANGUAGE.upper()
-                
-            if DEFAULT_SOURCE_LANGUAGE == "auto":
-                source_language_name = "Автоопределение"
-            else:
-                source_language_name = get_available_languages().get(DEFAULT_SOURCE_LANGUAGE)
-                if not source_language_name:
-                    source_language_name = DEFAULT_SOURCE_LANGUAGE.upper()
+    Returns:
+        UserSettings object detached from the session
+    """
+    try:
+        with Session() as session, session.begin():
+            # Пытаемся получить настройки пользователя из базы данных
+            query = session.query(UserSettings).filter_by(user_id=str(user_id))
+            settings = query.first()
+            
+            # Если настройки не найдены, создаем новые
+            if not settings:
+                # Получаем имена языков
+                language_name = COMMON_LANGUAGES.get(DEFAULT_LANGUAGE)
+                if not language_name:
+                    language_name = DEFAULT_LANGUAGE.upper()
                     
-            audio_language_name = AVAILABLE_AUDIO_LANGUAGES.get(DEFAULT_AUDIO_LANGUAGE)
-            if not audio_language_name:
-                audio_language_name = DEFAULT_AUDIO_LANGUAGE.upper()
+                if DEFAULT_SOURCE_LANGUAGE == "auto":
+                    source_language_name = "Автоопределение"
+                else:
+                    source_language_name = COMMON_LANGUAGES.get(DEFAULT_SOURCE_LANGUAGE)
+                    if not source_language_name:
+                        source_language_name = DEFAULT_SOURCE_LANGUAGE.upper()
+                        
+                audio_language_name = AVAILABLE_AUDIO_LANGUAGES.get(DEFAULT_AUDIO_LANGUAGE)
+                if not audio_language_name:
+                    audio_language_name = DEFAULT_AUDIO_LANGUAGE.upper()
+                    
+                voice_type_name = VOICE_TYPES.get(DEFAULT_VOICE_TYPE)
+                if not voice_type_name:
+                    voice_type_name = DEFAULT_VOICE_TYPE.upper()
                 
-            voice_type_name = VOICE_TYPES.get(DEFAULT_VOICE_TYPE)
-            if not voice_type_name:
-                voice_type_name = DEFAULT_VOICE_TYPE.upper()
-            
-            # Создаем новые настройки
-            settings = UserSettings()
-            settings.user_id = str(user_id)
-            settings.source_language = DEFAULT_SOURCE_LANGUAGE
-            settings.language = DEFAULT_LANGUAGE
-            settings.audio_language = DEFAULT_AUDIO_LANGUAGE
-            settings.voice_type = DEFAULT_VOICE_TYPE
-            settings.speed = DEFAULT_SPEED
-            settings.source_language_name = source_language_name
-            settings.language_name = language_name
-            settings.audio_language_name = audio_language_name
-            settings.voice_type_name = voice_type_name
+                values = {
+                    "user_id": str(user_id),
+                    "source_language": DEFAULT_SOURCE_LANGUAGE,
+                    "language": DEFAULT_LANGUAGE,
+                    "audio_language": DEFAULT_AUDIO_LANGUAGE,
+                    "voice_type": DEFAULT_VOICE_TYPE,
+                    "speed": DEFAULT_SPEED,
+                    "source_language_name": source_language_name,
+                    "language_name": language_name,
+                    "audio_language_name": audio_language_name,
+                    "voice_type_name": voice_type_name,
+                }
+                
+                # Создаем новые настройки одним INSERT ... ON CONFLICT DO NOTHING,
+                # чтобы параллельные обработчики не падали на уникальном user_id
+                stmt = _insert_ignore_statement(values)
+                if stmt is None:
+                    settings = UserSettings(**values)
+                    session.add(settings)
+                    session.flush()
+                elif engine.dialect.insert_returning:
+                    settings = session.scalars(stmt.returning(UserSettings)).first()
+                else:
+                    session.execute(stmt)
+                
+                # Строку уже вставил другой обработчик (или нет RETURNING)
+                if settings is None:
+                    settings = query.first()
+                logger.info(f"Created new settings for user {user_id}")
             
-            session.add(settings)
-            session.commit()
-            logger.info(f"Created new settings for user {user_id}")
-        
-        # Создаем копию объекта, чтобы избежать ошибки "не привязан к сессии"
-        user_settings = UserSettings()
-        user_settings.id = settings.id
-        user_settings.user_id = settings.user_id
-        user_settings.source_language = settings.source_language
-        user_settings.language = settings.language 
-        user_settings.audio_language = settings.audio_language
-        user_settings.voice_type = settings.voice_type
-        user_settings.speed = settings.speed
-        user_settings.source_language_name = settings.source_language_name
-        user_settings.language_name = settings.language_name
-        user_settings.audio_language_name = settings.audio_language_name
-        user_settings.voice_type_name = settings.voice_type_name
+            # Отвязываем объект от сессии; благодаря expire_on_commit=False
+            # все атрибуты остаются загруженными
+            session.expunge(settings)
         
-        return user_settings
+        return settings
     except SQLAlchemyError as e:
-        session.rollback()
         logger.error(f"Database error while getting user settings: {e}")
         raise
-    finally:
-        session.close()
 
-def update_user_language(user_id, language_code):
+def prefetch_user_settings(user_ids=None, limit=None):
     """
-    Update user's preferred translation language.
+    Load settings of several users with a single query and put them into the cache.
     
     Args:
-        user_id: User ID from Telegram
-        language_code: Language code to set
+        user_ids: User IDs from Telegram; if None, the most recently
+            registered users are loaded
+        limit: Maximal number of users to load when user_ids is None
+        
+    Returns:
+        list: UserSettings objects that were found
     """
-    session = Session()
     try:
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
-        if settings:
-            settings.language = language_code
-            # Получаем имя языка
-            language_name = get_available_languages().get(language_code)
-            # Обновляем имя языка
-            if language_name:
-                settings.language_name = language_name
+        with Session() as session, session.begin():
+            query = session.query(UserSettings)
+            if user_ids is not None:
+                query = query.filter(UserSettings.user_id.in_([str(user_id) for user_id in user_ids]))
             else:
-                # Если язык не найден в списке, используем код языка с заглавной буквы
-                settings.language_name = language_code.upper()
-            session.commit()
-            logger.info(f"Updated language for user {user_id} to {language_code}")
+                # id растет с регистрацией, поэтому новые пользователи идут первыми
+                query = query.order_by(UserSettings.id.desc())
+                if limit is not None:
+                    query = query.limit(limit)
+            settings_list = query.all()
+            for settings in settings_list:
+                session.expunge(settings)
+        
+        for settings in settings_list:
+            _settings_cache.set(settings.user_id, settings)
+        logger.info(f"Prefetched settings of {len(settings_list)} users")
+        return settings_list
     except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while updating user language: {e}")
+        logger.error(f"Database error while prefetching user settings: {e}")
         raise
-    finally:
-        session.close()
 
-def update_user_audio_language(user_id, language_code):
+def _update_user_settings(user_id, values):
     """
-    Update user's preferred audio language.
+    Update columns of user's settings with a single UPDATE statement.
     
     Args:
         user_id: User ID from Telegram
-        language_code: Language code to set
+        values: Dictionary of column names and new values
+        
+    Returns:
+        bool: True if the user's settings were found and updated
+    """
+    with Session() as session, session.begin():
+        updated = session.query(UserSettings).filter_by(user_id=str(user_id)).update(
+            values, synchronize_session=False
+        )
+    # Следующее чтение должно получить новые настройки из базы данных
+    invalidate_user_settings(user_id)
+    return updated > 0
+
+def display_name(setting, value):
+    """
+    Get the display name of a setting value.
+    
+    Args:
+        setting: Name of the setting (source_language, language, audio_language, voice_type)
+        value: Code of the value (e.g., 'en', 'auto', 'clear')
+        
+    Returns:
+        str: Display name of the value
+    """
+    if setting == "source_language" and value == 'auto':
+        return "Автоопределение"
+    names = AVAILABLE_AUDIO_LANGUAGES if setting == "audio_language" else (
+        VOICE_TYPES if setting == "voice_type" else COMMON_LANGUAGES
+    )
+    # Если значение не найдено в списке, используем его код с заглавной буквы
+    return names.get(value) or value.upper()
+
+def with_display_names(changes):
+    """
+    Complete changed settings with the display names of the new values.
+    
+    Args:
+        changes: Dictionary of changed settings (source_language, language,
+            audio_language, voice_type, speed)
+        
+    Returns:
+        dict: Column values to store, including the matching *_name columns
+    """
+    unknown = set(changes) - EDITABLE_SETTINGS
+    if unknown:
+        raise ValueError(f"Unknown user settings: {', '.join(sorted(unknown))}")
+    
+    values = dict(changes)
+    for setting, value in changes.items():
+        if setting == "speed":
+            # Преобразуем в float для безопасности
+            speed = float(value)
+            # Сравнение ложно и для NaN, поэтому он тоже отклоняется
+            if not min(SPEED_OPTIONS) <= speed <= max(SPEED_OPTIONS):
+                raise ValueError(f"Speed {value} is out of range")
+            values["speed"] = speed
+        else:
+            values[f"{setting}_name"] = display_name(setting, value)
+    return values
+
+def update_user_settings(user_id, **changes):
     """
-    session = Session()
+    Update several user settings at once, in a single transaction.
+    
+    Args:
+        user_id: User ID from Telegram
+        **changes: New values of settings (source_language, language,
+            audio_language, voice_type, speed)
+    """
+    if not changes:
+        return
+    values = with_display_names(changes)
     try:
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
-        if settings:
-            settings.audio_language = language_code
-            # Получаем имя языка озвучивания
-            audio_language_name = AVAILABLE_AUDIO_LANGUAGES.get(language_code)
-            # Обновляем имя языка озвучивания
-            if audio_language_name:
-                settings.audio_language_name = audio_language_name
-            else:
-                # Если язык не найден в списке, используем код языка с заглавной буквы
-                settings.audio_language_name = language_code.upper()
-            session.commit()
-            logger.info(f"Updated audio language for user {user_id} to {language_code}")
+        if _update_user_settings(user_id, values):
+            logger.info(f"Updated settings for user {user_id}: {changes}")
     except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while updating user audio language: {e}")
+        logger.error(f"Database error while updating user settings: {e}")
         raise
-    finally:
-        session.close()
+
+def update_user_language(user_id, language_code):
+    """
+    Update user's preferred translation language.
+    
+    Args:
+        user_id: User ID from Telegram
+        language_code: Language code to set
+    """
+    update_user_settings(user_id, language=language_code)
+
+def update_user_audio_language(user_id, language_code):
+    """
+    Update user's preferred audio language.
+    
+    Args:
+        user_id: User ID from Telegram
+        language_code: Language code to set
+    """
+    update_user_settings(user_id, audio_language=language_code)
 
 def update_user_voice_type(user_id, voice_type):
     """
@@ -189,27 +390,7 @@ def update_user_voice_type(user_id, voice_type):
         user_id: User ID from Telegram
         voice_type: Voice type code to set
     """
-    session = Session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
-        if settings:
-            settings.voice_type = voice_type
-            # Получаем имя типа голоса
-            voice_type_name = VOICE_TYPES.get(voice_type)
-            # Обновляем имя типа голоса
-            if voice_type_name:
-                settings.voice_type_name = voice_type_name
-            else:
-                # Если тип голоса не найден в списке, используем код типа с заглавной буквы
-                settings.voice_type_name = voice_type.upper()
-            session.commit()
-            logger.info(f"Updated voice type for user {user_id} to {voice_type}")
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while updating user voice type: {e}")
-        raise
-    finally:
-        session.close()
+    update_user_settings(user_id, voice_type=voice_type)
 
 def update_user_source_language(user_id, language_code):
     """
@@ -219,29 +400,7 @@ def update_user_source_language(user_id, language_code):
         user_id: User ID from Telegram
         language_code: Language code to set (or 'auto' for automatic detection)
     """
-    session = Session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
-        if settings:
-            settings.source_language = language_code
-            # Получаем имя языка
-            if language_code == 'auto':
-                source_language_name = "Автоопределение"
-            else:
-                source_language_name = get_available_languages().get(language_code)
-                if not source_language_name:
-                    # Если язык не найден в списке, используем код языка с заглавной буквы
-                    source_language_name = language_code.upper()
-            # Обновляем имя языка
-            settings.source_language_name = source_language_name
-            session.commit()
-            logger.info(f"Updated source language for user {user_id} to {language_code}")
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while updating user source language: {e}")
-        raise
-    finally:
-        session.close()
+    update_user_settings(user_id, source_language=language_code)
 
 def update_user_speed(user_id, speed):
     """
@@ -251,19 +410,4 @@ def update_user_speed(user_id, speed):
         user_id: User ID from Telegram
         speed: Speed value to set
     """
-    session = Session()
-    try:
-        settings = session.query(UserSettings).filter_by(user_id=str(user_id)).first()
-        if settings:
-            # Преобразуем в float для безопасности
-            speed_float = float(speed)
-            # Обновляем скорость
-            settings.speed = speed_float
-            session.commit()
-            logger.info(f"Updated speed for user {user_id} to {speed}")
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while updating user speed: {e}")
-        raise
-    finally:
-        session.close()
\ No newline at end of file
+    update_user_settings(user_id, speed=speed)
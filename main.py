@@ -2,6 +2,7 @@
 """
 Основной файл для запуска Telegram-бота.
 """
+import importlib
 import sys
 import os
 import logging
@@ -18,10 +19,6 @@ if not os.environ.get('TELEGRAM_BOT_TOKEN'):
     os.environ['TELEGRAM_BOT_TOKEN'] = telegram_token
     print(f"Установлен токен TELEGRAM_BOT_TOKEN")
 
-# Инициализация базы данных
-from database import init_db
-init_db()
-
 # Для обратной совместимости с workflow, который пытается запустить Flask-приложение
 # Создаем заглушку для gunicorn
 class DummyApp:
@@ -38,5 +35,24 @@ app = DummyApp()
 from bot import main
 
 if __name__ == "__main__":
+    # Инициализация базы данных (только при запуске бота, не при импорте WSGI-приложения)
+    from database import init_db
+    init_db()
+    
+    # Заранее загружаем Tesseract и модель Vosk, чтобы первое сообщение не ждало их
+    # (ошибка импорта или загрузки не мешает запуску бота)
+    for module_name in ("ocr", "speech_to_text"):
+        try:
+            importlib.import_module(module_name).warm_up()
+        except Exception as e:
+            logging.warning(f"Не удалось заранее загрузить {module_name}: {e}")
+    
+    # Заранее загружаем настройки недавних пользователей
+    try:
+        from user_preferences import prefetch_prefs
+        prefetch_prefs(limit=int(os.environ.get("PREFETCH_USERS", 1000)))
+    except Exception as e:
+        logging.warning(f"Не удалось заранее загрузить настройки пользователей: {e}")
+    
     # Запускаем основную функцию из bot.py
     sys.exit(main())
\ No newline at end of file
@@ -4,12 +4,109 @@ Uses Tesseract OCR for image recognition.
 """
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageFilter
 
 # Logger for this module
 logger = logging.getLogger(__name__)
 
+# Tesseract options: LSTM engine only, image treated as a single uniform block of text
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+
+# Pre-filter settings: images are scaled down to this width before edge detection
+THUMBNAIL_WIDTH = 256
+# Minimal edge intensity (0-255) counted as a sharp, text-like contrast
+EDGE_LEVEL = 32
+# Minimal share of sharp edge pixels for an image to be sent to Tesseract
+MIN_EDGE_RATIO = 0.0001
+
+# Tall images are split into horizontal strips recognized in parallel.
+# Each strip is at least this high, so images up to twice the value stay whole
+MIN_STRIP_HEIGHT = 600
+# Maximal number of strips (and parallel Tesseract processes) per image
+MAX_STRIPS = 4
+
+# pytesseract runs the tesseract binary in a subprocess, so threads are enough
+# to keep several cores busy
+OCR_WORKERS = min(MAX_STRIPS, os.cpu_count() or 1)
+_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+
+def warm_up():
+    """
+    Probe the Tesseract binary in advance so the first image does not pay for it.
+    """
+    version = pytesseract.get_tesseract_version()
+    logger.info(f"Tesseract {version} is available")
+
+def has_text_like_content(image):
+    """
+    Quickly check whether an image may contain text.
+    
+    Text always produces sharp contrast edges, so images without them
+    (solid colors, smooth gradients, blurred backgrounds) are rejected
+    without running Tesseract.
+    
+    Args:
+        image (PIL.Image.Image): Grayscale image
+        
+    Returns:
+        bool: False if the image certainly has no text, True otherwise
+    """
+    width, height = image.size
+    if width < 3 or height < 3:
+        return False
+    
+    thumb = image.resize((THUMBNAIL_WIDTH, max(3, int(THUMBNAIL_WIDTH * height / width))))
+    edges = thumb.filter(ImageFilter.FIND_EDGES)
+    # The filter marks the outer border as edges, so it is cut off
+    edges = edges.crop((1, 1, edges.width - 1, edges.height - 1))
+    
+    histogram = edges.histogram()
+    sharp_pixels = sum(histogram[EDGE_LEVEL:])
+    return sharp_pixels >= MIN_EDGE_RATIO * edges.width * edges.height
+
+def _find_cut(image, y, margin):
+    """
+    Find the row near y that crosses the least text.
+    
+    Args:
+        image (PIL.Image.Image): Grayscale image
+        y (int): Preferred row to cut at
+        margin (int): Maximal distance from y to search in
+        
+    Returns:
+        int: Row to cut the image at
+    """
+    top = max(1, y - margin)
+    bottom = min(image.height - 1, y + margin)
+    band = image.crop((0, top - 1, image.width, bottom + 1)).filter(ImageFilter.FIND_EDGES)
+    # Average edge intensity of every row, computed by squeezing the band to 1 pixel wide
+    profile = list(band.crop((1, 1, band.width - 1, band.height - 1)).resize(
+        (1, bottom - top), Image.BOX
+    ).getdata())
+    return top + min(range(len(profile)), key=profile.__getitem__)
+
+def _split_into_strips(image):
+    """
+    Split a tall image into horizontal strips for parallel recognition.
+    
+    Args:
+        image (PIL.Image.Image): Grayscale image
+        
+    Returns:
+        list: Image strips from top to bottom (the image itself if it is small)
+    """
+    width, height = image.size
+    count = min(OCR_WORKERS, height // MIN_STRIP_HEIGHT)
+    if count < 2:
+        return [image]
+    
+    strip_height = height // count
+    cuts = [_find_cut(image, i * strip_height, strip_height // 10) for i in range(1, count)]
+    bounds = [0] + cuts + [height]
+    return [image.crop((0, y0, width, y1)) for y0, y1 in zip(bounds, bounds[1:])]
+
 def extract_text_from_image(image_path):
     """
     Extract text from an image using Tesseract OCR.
@@ -27,11 +124,25 @@ def extract_text_from_image(image_path):
     try:
         # Open the image using PIL
         logger.info(f"Opening image: {image_path}")
-        image = Image.open(image_path)
+        image = Image.open(image_path).convert("L")
+        
+        # Skip Tesseract for images without any text-like content
+        if not has_text_like_content(image):
+            logger.info(f"No text-like content found in image: {image_path}")
+            return ""
         
         # Extract text from the image using pytesseract
         logger.info(f"Extracting text from image: {image_path}")
-        extracted_text = pytesseract.image_to_string(image)
+        strips = _split_into_strips(image)
+        if len(strips) == 1:
+            extracted_text = pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+        else:
+            logger.info(f"Recognizing image in {len(strips)} strips")
+            texts = _pool.map(
+                lambda strip: pytesseract.image_to_string(strip, config=TESSERACT_CONFIG).strip(),
+                strips
+            )
+            extracted_text = "\n".join(texts)
         
         # Clean up the text (remove extra whitespace)
         extracted_text = extracted_text.strip()
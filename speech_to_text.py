@@ -2,15 +2,263 @@
 Speech-to-text module for converting voice messages to text.
 Uses SpeechRecognition library for local speech recognition.
 """
+import hashlib
+import importlib.util
+import json
 import logging
 import os
-import tempfile
 import subprocess
+import threading
 import speech_recognition as sr
 
+from cache import TTLCache
+from tempfiles import temp_files
+
+# Optional recognition and conversion backends
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+try:
+    from pydub import AudioSegment
+except ImportError:
+    AudioSegment = None
+
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
 # Logger for this module
 logger = logging.getLogger(__name__)
 
+# Частота дискретизации, с которой работает модель Vosk
+VOSK_SAMPLE_RATE = 16000
+# Размер порции PCM для Vosk: одна секунда 16-bit mono аудио
+VOSK_CHUNK_SIZE = VOSK_SAMPLE_RATE * 2
+
+# Каталог с моделью Vosk проверяем один раз при импорте
+VOSK_MODEL_PATH = "model"
+VOSK_MODEL_AVAILABLE = os.path.isdir(VOSK_MODEL_PATH)
+
+# Extensions of Telegram voice messages (OGG/Opus with a consistent noise floor)
+TELEGRAM_VOICE_EXTENSIONS = (".ogg", ".oga")
+
+# Formats SpeechRecognition reads directly, without conversion to WAV
+NATIVE_AUDIO_EXTENSIONS = (".flac", ".aiff", ".aif")
+
+# Timeout in seconds for online recognition services
+RECOGNITION_TIMEOUT = 4
+
+# Russian language model for Sphinx, if installed
+SPHINX_RU_MODEL_PATH = "/usr/local/share/pocketsphinx/model/ru-RU"
+SPHINX_RU_MODEL_AVAILABLE = os.path.exists(SPHINX_RU_MODEL_PATH)
+
+# Recognized text of recently seen audio files, keyed by a hash of their content.
+# Forwarded and re-sent voice messages are recognized only once
+_recognition_cache = TTLCache(maxsize=1024, ttl=86400)
+
+# Модель Vosk загружается один раз и переиспользуется между сообщениями
+_vosk_model = None
+_vosk_lock = threading.Lock()
+
+def _get_vosk_model():
+    """
+    Load the Vosk model on first use and return the shared instance.
+    
+    Returns:
+        vosk.Model: Loaded Vosk model
+    """
+    global _vosk_model
+    if _vosk_model is None:
+        with _vosk_lock:
+            if _vosk_model is None:
+                _vosk_model = vosk.Model(VOSK_MODEL_PATH)
+    return _vosk_model
+
+def warm_up():
+    """
+    Load the Vosk model in advance so the first voice message does not pay for it.
+    """
+    if vosk is not None and VOSK_MODEL_AVAILABLE:
+        _get_vosk_model()
+        logger.info("Vosk model loaded")
+
+def _recognize_google(recognizer, audio_data, audio_file):
+    """
+    Recognize speech with the free Google Speech Recognition API.
+    
+    Args:
+        recognizer (sr.Recognizer): Configured recognizer
+        audio_data (sr.AudioData): Recorded audio
+        audio_file (str): Path to the WAV file with the same audio
+        
+    Returns:
+        str: Transcribed text, or None if the speech was not understood
+    """
+    # Russian first, as that is what we usually get, then English
+    for language in ("ru", "en-US"):
+        try:
+            text = recognizer.recognize_google(audio_data, language=language)
+            logger.info(f"Transcribed audio with Google Speech Recognition (language: {language})")
+            return text
+        except sr.UnknownValueError:
+            logger.warning(f"Google Speech Recognition could not understand audio in {language}")
+    return None
+
+def _recognize_google_cloud(recognizer, audio_data, audio_file):
+    """
+    Recognize speech with Google Cloud Speech.
+    
+    Args:
+        recognizer (sr.Recognizer): Configured recognizer
+        audio_data (sr.AudioData): Recorded audio
+        audio_file (str): Path to the WAV file with the same audio
+        
+    Returns:
+        str: Transcribed text, or None if the speech was not understood
+    """
+    for language in ("ru-RU", "en-US"):
+        try:
+            text = recognizer.recognize_google_cloud(
+                audio_data,
+                language=language,
+                preferred_phrases=["привет", "как дела", "что ты умеешь", "спасибо"]
+            )
+            logger.info(f"Transcribed audio with Google Cloud Speech Recognition (language: {language})")
+            return text
+        except sr.UnknownValueError:
+            logger.warning(f"Google Cloud Speech could not understand audio in {language}")
+    return None
+
+def _recognize_sphinx(recognizer, audio_data, audio_file):
+    """
+    Recognize speech offline with CMU Sphinx.
+    
+    Args:
+        recognizer (sr.Recognizer): Configured recognizer
+        audio_data (sr.AudioData): Recorded audio
+        audio_file (str): Path to the WAV file with the same audio
+        
+    Returns:
+        str: Transcribed text
+    """
+    # Use the Russian language model if it is installed
+    if SPHINX_RU_MODEL_AVAILABLE:
+        text = recognizer.recognize_sphinx(audio_data, language=SPHINX_RU_MODEL_PATH)
+    else:
+        text = recognizer.recognize_sphinx(audio_data)
+    logger.info("Transcribed audio with CMU Sphinx (offline)")
+    return text
+
+def _recognize_openai(recognizer, audio_data, audio_file):
+    """
+    Recognize speech with the OpenAI Whisper API.
+    
+    Args:
+        recognizer (sr.Recognizer): Configured recognizer
+        audio_data (sr.AudioData): Recorded audio
+        audio_file (str): Path to the WAV file with the same audio
+        
+    Returns:
+        str: Transcribed text
+    """
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    with open(audio_file, "rb") as file:
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=file
+        )
+    logger.info("Transcribed audio with OpenAI API")
+    return transcript.text
+
+# Recognition services are probed once at import, so a request only waits for
+# the services that can actually work here (in priority order)
+_ENGINES = tuple(engine for engine, available in (
+    (_recognize_google, True),
+    (_recognize_google_cloud, bool(os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"))),
+    (_recognize_sphinx, importlib.util.find_spec("pocketsphinx") is not None),
+    (_recognize_openai, OpenAI is not None and bool(os.environ.get("OPENAI_API_KEY"))),
+) if available)
+
+def is_pcm_wav(audio_path):
+    """
+    Check by the file header whether an audio file is an uncompressed PCM WAV.
+    
+    Args:
+        audio_path (str): Path to the audio file
+        
+    Returns:
+        bool: True if the file is a PCM WAV file
+    """
+    try:
+        with open(audio_path, "rb") as file:
+            header = file.read(22)
+    except OSError:
+        return False
+    # RIFF header, WAVE type, then the "fmt " chunk with audio format code 1 (PCM)
+    return (
+        len(header) == 22
+        and header[:4] == b"RIFF"
+        and header[8:16] == b"WAVEfmt "
+        and int.from_bytes(header[20:22], "little") == 1
+    )
+
+def _read_pcm(audio_path):
+    """
+    Decode an audio file to 16 kHz mono 16-bit PCM for Vosk.
+    
+    Args:
+        audio_path (str): Path to the audio file
+        
+    Yields:
+        bytes: Consecutive chunks of PCM data, one second each
+    """
+    if AudioSegment is not None and is_pcm_wav(audio_path):
+        # pydub читает PCM WAV сам, без запуска ffmpeg, и приводит формат в памяти
+        audio = AudioSegment.from_file(audio_path, format="wav")
+        pcm = audio.set_frame_rate(VOSK_SAMPLE_RATE).set_channels(1).set_sample_width(2).raw_data
+        for i in range(0, len(pcm), VOSK_CHUNK_SIZE):
+            yield pcm[i:i + VOSK_CHUNK_SIZE]
+        return
+    
+    # ffmpeg декодирует остальные форматы сразу в нужный PCM и отдает его через pipe,
+    # без промежуточных WAV файлов
+    proc = subprocess.Popen(
+        ['ffmpeg', '-i', audio_path, '-f', 's16le', '-acodec', 'pcm_s16le',
+         '-ar', str(VOSK_SAMPLE_RATE), '-ac', '1', '-loglevel', 'quiet', '-'],
+        stdout=subprocess.PIPE
+    )
+    try:
+        while True:
+            data = proc.stdout.read(VOSK_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        proc.stdout.close()
+        proc.wait()
+    
+    if proc.returncode != 0:
+        logger.warning(f"ffmpeg завершился с кодом {proc.returncode} при декодировании для Vosk")
+
+def _file_hash(path):
+    """
+    Compute a hash of a file's content.
+    
+    Args:
+        path (str): Path to the file
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 def speech_to_text(audio_path):
     """
     Convert speech to text using offline and online recognition methods.
@@ -25,179 +273,84 @@ def speech_to_text(audio_path):
         logger.error(f"Audio file not found: {audio_path}")
         return ""
     
-    # Проверяем наличие Vosk модели сразу
-    vosk_model_available = os.path.exists("model") and os.path.isdir("model")
+    # The same audio was already recognized recently
+    audio_hash = _file_hash(audio_path)
+    cached_text = _recognition_cache.get(audio_hash)
+    if cached_text is not None:
+        logger.info("Using cached transcription of the same audio")
+        return cached_text
     
     try:
-        # Try to convert audio to wav format for better compatibility
-        temp_wav_file = convert_to_wav(audio_path)
-        file_to_use = temp_wav_file if temp_wav_file else audio_path
-        
         # Попробуем сначала использовать Vosk для русского языка, если модель доступна
-        if vosk_model_available:
+        if vosk is not None and VOSK_MODEL_AVAILABLE:
             try:
-                import vosk
-                import json
-                import wave
-                
                 logger.info("Используем русскую модель Vosk для распознавания речи")
                 
-                # Конвертируем аудио в WAV формат для Vosk, если еще не сделано
-                if not file_to_use.endswith('.wav'):
-                    vosk_wav_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-                    vosk_wav_file.close()
-                    
-                    from pydub import AudioSegment
-                    audio = AudioSegment.from_file(file_to_use)
-                    audio = audio.set_frame_rate(16000).set_channels(1)
-                    audio.export(vosk_wav_file.name, format="wav")
-                    
-                    vosk_file = vosk_wav_file.name
-                else:
-                    vosk_file = file_to_use
+                # Получаем загруженную модель и создаем распознаватель
+                model = _get_vosk_model()
+                rec = vosk.KaldiRecognizer(model, VOSK_SAMPLE_RATE)
+                rec.SetWords(True)  # Включаем информацию о словах
                 
-                # Инициализируем модель и распознаватель
-                model = vosk.Model("model")
+                # Обрабатываем аудиопоток порциями по одной секунде
+                for data in _read_pcm(audio_path):
+                    rec.AcceptWaveform(data)
                 
-                # Открываем файл как wave объект
-                wf = wave.open(vosk_file, "rb")
+                # Получаем финальный результат
+                result = json.loads(rec.FinalResult())
                 
-                # Проверяем формат
-                if wf.getnchannels() != 1 or wf.getsampwidth() != 2 or wf.getcomptype() != "NONE":
-                    logger.warning("Аудио файл должен быть в формате WAV mono 16bit PCM")
-                else:
-                    # Создаем распознаватель с правильной частотой дискретизации
-                    rec = vosk.KaldiRecognizer(model, wf.getframerate())
-                    rec.SetWords(True)  # Включаем информацию о словах
-                    
-                    # Обрабатываем аудиофайл порциями
-                    while True:
-                        data = wf.readframes(4000)  # Читаем по 4000 фреймов
-                        if len(data) == 0:
-                            break
-                        rec.AcceptWaveform(data)
-                    
-                    # Получаем финальный результат
-                    result_json = rec.FinalResult()
-                    result = json.loads(result_json)
-                    
-                    # Закрываем файл
-                    wf.close()
-                    
-                    # Удаляем временный файл, если он был создан
-                    try:
-                        if 'vosk_wav_file' in locals() and hasattr(vosk_wav_file, 'name') and os.path.exists(vosk_wav_file.name):
-                            os.remove(vosk_wav_file.name)
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить временный файл: {e}")
-                    
-                    # Проверяем, что результат не пустой
-                    if result and "text" in result and result["text"]:
-                        text = result["text"]
-                        logger.info(f"Transcribed audio with Vosk (Russian): {text}")
-                        return text
+                # Проверяем, что результат не пустой
+                if result and "text" in result and result["text"]:
+                    text = result["text"]
+                    logger.info(f"Transcribed audio with Vosk (Russian): {text}")
+                    _recognition_cache.set(audio_hash, text)
+                    return text
             except Exception as e:
                 logger.warning(f"Ошибка при использовании Vosk: {e}")
         
+        # Convert to WAV only the formats SpeechRecognition cannot read directly
+        if is_pcm_wav(audio_path) or audio_path.lower().endswith(NATIVE_AUDIO_EXTENSIONS):
+            temp_wav_file = None
+            file_to_use = audio_path
+        else:
+            temp_wav_file = convert_to_wav(audio_path)
+            file_to_use = temp_wav_file if temp_wav_file else audio_path
+        
         # Initialize the recognizer
         recognizer = sr.Recognizer()
-        
-        # Increase the energy threshold to improve accuracy
-        recognizer.energy_threshold = 300
+        recognizer.operation_timeout = RECOGNITION_TIMEOUT
         
         # Load the audio file
         with sr.AudioFile(file_to_use) as source:
-            # Adjust for ambient noise and record with more dynamic adjustment
-            recognizer.adjust_for_ambient_noise(source, duration=1)
+            if audio_path.lower().endswith(TELEGRAM_VOICE_EXTENSIONS):
+                # Telegram voice messages are already normalized, so a fixed threshold
+                # is used instead of spending the first second on noise calibration
+                recognizer.energy_threshold = 200
+                recognizer.dynamic_energy_threshold = False
+            else:
+                # Increase the energy threshold to improve accuracy
+                recognizer.energy_threshold = 300
+                
+                # Adjust for ambient noise and record with more dynamic adjustment
+                recognizer.adjust_for_ambient_noise(source, duration=1)
             
-            # Set operation timeout to a higher value for better processing (default is 10s)
             audio_data = recognizer.record(source, duration=None)
             
-            # Try different recognition services in order
-            
-            # Try to detect the language of speech - default to Russian as that appears to be what we're getting
-            detected_language = "ru"
-            
-            # 1. Try Google Speech Recognition API with specific language hints
-            try:
-                # Try with Russian first (or the detected language)
-                text = recognizer.recognize_google(audio_data, language=detected_language)
-                logger.info(f"Transcribed audio with Google Speech Recognition (language: {detected_language})")
-                return text
-            except sr.UnknownValueError:
-                logger.warning(f"Google Speech Recognition could not understand audio in {detected_language}")
-                
-                # Try with other languages if Russian fails
+            # Try the recognition services available in this environment in order
+            for engine in _ENGINES:
                 try:
-                    # Try English
-                    text = recognizer.recognize_google(audio_data, language="en-US")
-                    logger.info("Transcribed audio with Google Speech Recognition (language: en-US)")
+                    text = engine(recognizer, audio_data, file_to_use)
+                except (sr.UnknownValueError, sr.RequestError, LookupError) as e:
+                    logger.warning(f"Recognition with {engine.__name__} failed: {e}")
+                    continue
+                except Exception as e:
+                    # Unexpected backend errors (client libraries, API errors) only skip this engine
+                    logger.error(f"Unexpected error in {engine.__name__}: {e}")
+                    continue
+                if text:
+                    _recognition_cache.set(audio_hash, text)
                     return text
-                except sr.UnknownValueError:
-                    logger.warning("Google Speech Recognition could not understand audio in en-US")
-            except sr.RequestError as e:
-                logger.warning(f"Could not request results from Google Speech Recognition service; {e}")
-            
-            # 2. Try Google Cloud Speech if available
-            try:
-                # Try with various language options (preferring Russian)
-                for lang in ["ru-RU", "en-US"]:
-                    try:
-                        text = recognizer.recognize_google_cloud(
-                            audio_data, 
-                            language=lang,
-                            preferred_phrases=["привет", "как дела", "что ты умеешь", "спасибо"]
-                        )
-                        logger.info(f"Transcribed audio with Google Cloud Speech Recognition (language: {lang})")
-                        return text
-                    except sr.UnknownValueError:
-                        logger.warning(f"Google Cloud Speech could not understand audio in {lang}")
-                    except sr.RequestError:
-                        logger.warning("Google Cloud Speech API not available")
-                        break
-            except (sr.UnknownValueError, LookupError, AttributeError):
-                pass
-            
-            # 3. Try Sphinx for offline recognition with Russian support
-            try:
-                # Explicitly specify language model for Russian if available
-                # This might not work well without proper language models installed
-                language_model = None
-                try:
-                    # If Russian language model exists
-                    if os.path.exists("/usr/local/share/pocketsphinx/model/ru-RU"):
-                        language_model = "/usr/local/share/pocketsphinx/model/ru-RU"
-                except:
-                    pass
-                
-                if language_model:
-                    text = recognizer.recognize_sphinx(audio_data, language=language_model)
-                else:
-                    text = recognizer.recognize_sphinx(audio_data)
-                
-                logger.info("Transcribed audio with CMU Sphinx (offline)")
-                return text
-            except (sr.UnknownValueError, LookupError) as e:
-                logger.warning(f"Sphinx could not understand audio or Sphinx not installed: {e}")
             
-            # 4. If we have OpenAI API key, use whisper API
-            if os.environ.get("OPENAI_API_KEY"):
-                from openai import OpenAI
-                
-                client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-                
-                with open(file_to_use, "rb") as audio_file:
-                    transcript = client.audio.transcriptions.create(
-                        model="whisper-1", 
-                        file=audio_file
-                    )
-                
-                logger.info(f"Transcribed audio with OpenAI API")
-                return transcript.text
-            
-            # Vosk уже проверен выше, поэтому эта часть не нужна
-                
-            # 6. As a final resort, return a helpful message
+            # As a final resort, return a helpful message
             logger.warning("All speech recognition methods failed")
             return "Не удалось распознать речь. Пожалуйста, говорите четче или попробуйте отправить текстовое сообщение."
             
@@ -205,15 +358,9 @@ def speech_to_text(audio_path):
         logger.error(f"Error transcribing audio: {e}")
         return f"Ошибка при распознавании речи: {str(e)}"
     finally:
-        # Clean up temporary file
-        try:
-            if 'temp_wav_file' in locals() and temp_wav_file and os.path.exists(temp_wav_file):
-                try:
-                    os.remove(temp_wav_file)
-                except:
-                    pass
-        except:
-            pass
+        # Return the temporary WAV file to the pool
+        if 'temp_wav_file' in locals() and temp_wav_file:
+            temp_files.release(temp_wav_file)
 
 def convert_to_wav(input_file):
     """
@@ -223,19 +370,18 @@ def convert_to_wav(input_file):
         input_file (str): Path to the input audio file
         
     Returns:
-        str: Path to the WAV file, or None if conversion failed
+        str: Path to the WAV file from the temporary file pool (the caller
+            releases it), or None if conversion failed
     """
     temp_file_name = None
     try:
-        from pydub import AudioSegment
-        
-        # Create a temporary file for WAV audio
-        temp_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-        temp_file_name = temp_file.name
-        temp_file.close()
+        # Take a temporary file for WAV audio from the pool
+        temp_file_name = temp_files.acquire('.wav')
         
         # Try to convert using pydub
         try:
+            if AudioSegment is None:
+                raise ImportError("pydub is not installed")
             audio = AudioSegment.from_file(input_file)
             audio.export(temp_file_name, format="wav")
             logger.info(f"Converted audio to WAV format using pydub")
@@ -250,15 +396,11 @@ def convert_to_wav(input_file):
                 return temp_file_name
             except Exception as ffmpeg_err:
                 logger.error(f"Failed to convert audio to WAV format with ffmpeg: {ffmpeg_err}")
-                if temp_file_name and os.path.exists(temp_file_name):
-                    os.remove(temp_file_name)
+                temp_files.release(temp_file_name)
                 return None
     
     except Exception as e:
         logger.error(f"Error converting audio to WAV: {e}")
-        if temp_file_name and os.path.exists(temp_file_name):
-            try:
-                os.remove(temp_file_name)
-            except:
-                pass
+        if temp_file_name:
+            temp_files.release(temp_file_name)
         return None
\ No newline at end of file
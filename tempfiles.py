@@ -0,0 +1,99 @@
+"""
+Temporary files module with a pool of reusable temporary file paths.
+Файлы создаются в отдельной директории процесса и переиспользуются вместо
+создания и удаления нового временного файла на каждый запрос.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class TempFilePool:
+    """
+    Thread-safe pool of temporary file paths inside a per-process directory.
+
+    A released file is truncated and handed out again by the next acquire()
+    with the same suffix, so busy handlers reuse a small set of files instead
+    of creating and unlinking a new one for every request.
+    """
+
+    def __init__(self, max_free=32, prefix="bot_"):
+        """
+        Initialize the pool and create its directory.
+
+        Args:
+            max_free (int): Maximum number of free files kept per suffix;
+                files released over the limit are removed
+            prefix (str): Prefix of the pool directory name
+        """
+        self.max_free = max_free
+        self.directory = tempfile.mkdtemp(prefix=prefix)
+        self._free = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+        atexit.register(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def acquire(self, suffix=""):
+        """
+        Get a temporary file path for exclusive use until it is released.
+
+        Args:
+            suffix (str): File name suffix (e.g., '.ogg', '.wav')
+
+        Returns:
+            str: Path to an empty file
+        """
+        with self._lock:
+            free = self._free.get(suffix)
+            if free:
+                return free.pop()
+            self._counter += 1
+            path = os.path.join(self.directory, f"tmp_{self._counter}{suffix}")
+        # Создаем пустой файл, как это делает NamedTemporaryFile
+        open(path, 'wb').close()
+        return path
+
+    def release(self, path):
+        """
+        Return a path obtained from acquire() to the pool.
+
+        Args:
+            path (str): Path returned by acquire()
+        """
+        suffix = os.path.splitext(path)[1]
+        try:
+            # Очищаем файл, чтобы следующий запрос не прочитал чужие данные
+            os.truncate(path, 0)
+        except OSError:
+            # Файл удален или поврежден - просто не возвращаем его в пул
+            return
+        with self._lock:
+            free = self._free.setdefault(suffix, [])
+            if len(free) < self.max_free:
+                free.append(path)
+                return
+        os.remove(path)
+
+    @contextmanager
+    def path(self, suffix=""):
+        """
+        Use a temporary file path within a with block.
+
+        Args:
+            suffix (str): File name suffix (e.g., '.ogg', '.wav')
+
+        Yields:
+            str: Path to an empty file, released when the block exits
+        """
+        path = self.acquire(suffix)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+
+# Общий пул временных файлов процесса
+temp_files = TempFilePool()
@@ -1,16 +1,388 @@
 """
 Text-to-speech module for converting text to audio.
-Uses gTTS for speech synthesis and pydub for audio processing.
+Uses gTTS (or Microsoft Edge voices via edge-tts, if enabled) for speech synthesis
+and ffmpeg for audio processing; audio is returned as in-memory mp3 files.
 """
+import asyncio
+import hashlib
 import logging
+import math
 import os
+import re
+import subprocess
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from gtts import gTTS
-from pydub import AudioSegment
+
+from constants import VOICE_TYPES, AVAILABLE_AUDIO_LANGUAGES, SPEED_OPTIONS
+
+# Optional synthesis backend
+try:
+    import edge_tts
+except ImportError:
+    edge_tts = None
 
 # Logger for this module
 logger = logging.getLogger(__name__)
 
+# Disk cache of synthesized speech: repeated phrases are not sent to gTTS again
+TTS_CACHE_DIR = os.environ.get(
+    "TTS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "bot_tts")
+)
+# Maximal number of cached audio files, least recently used ones are removed first
+TTS_CACHE_MAX_FILES = int(os.environ.get("TTS_CACHE_MAX_FILES", 2000))
+# The cache directory is scanned once per this many stored files, so it may
+# temporarily hold up to TTS_CACHE_PRUNE_INTERVAL files over the limit
+TTS_CACHE_PRUNE_INTERVAL = 100
+# Partial files older than this (seconds) were left by interrupted writes
+TTS_CACHE_PARTIAL_MAX_AGE = 3600
+
+# Speech synthesis engine: "gtts" or "edge" (edge-tts, falls back to gTTS on errors)
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "gtts").lower()
+
+# Edge voices for audio languages; gTTS is used for languages missing here
+EDGE_VOICES = {
+    'ru': 'ru-RU-SvetlanaNeural',
+    'en': 'en-US-AriaNeural',
+    'fr': 'fr-FR-DeniseNeural',
+    'de': 'de-DE-KatjaNeural',
+    'es': 'es-ES-ElviraNeural',
+    'it': 'it-IT-ElsaNeural',
+    'pt': 'pt-BR-FranciscaNeural',
+    'zh-CN': 'zh-CN-XiaoxiaoNeural',
+    'ja': 'ja-JP-NanamiNeural',
+    'ko': 'ko-KR-SunHiNeural',
+    'ar': 'ar-SA-ZariyahNeural',
+    'fa': 'fa-IR-DilaraNeural',
+    'tr': 'tr-TR-EmelNeural',
+    'cs': 'cs-CZ-VlastaNeural',
+    'pl': 'pl-PL-ZofiaNeural',
+    'uk': 'uk-UA-PolinaNeural',
+    'bg': 'bg-BG-KalinaNeural',
+    'sv': 'sv-SE-SofieNeural',
+    'no': 'nb-NO-PernilleNeural',
+    'fi': 'fi-FI-NooraNeural',
+    'da': 'da-DK-ChristelNeural',
+    'nl': 'nl-NL-ColetteNeural',
+    'el': 'el-GR-AthinaNeural',
+    'hu': 'hu-HU-NoemiNeural',
+    'ro': 'ro-RO-AlinaNeural',
+    'hi': 'hi-IN-SwaraNeural',
+    'th': 'th-TH-PremwadeeNeural',
+    'vi': 'vi-VN-HoaiMyNeural',
+    'id': 'id-ID-GadisNeural',
+    'he': 'he-IL-HilaNeural',
+    'sk': 'sk-SK-ViktoriaNeural',
+    'hr': 'hr-HR-GabrijelaNeural',
+}
+# Regional voices matching the accents gTTS gets from other Google domains
+EDGE_REGIONAL_VOICES = {
+    ('en', 'co.uk'): 'en-GB-RyanNeural',
+    ('pt', 'co.uk'): 'pt-PT-RaquelNeural',
+    ('fr', 'co.uk'): 'fr-FR-HenriNeural',
+    ('fr', 'ca'): 'fr-CA-SylvieNeural',
+    ('es', 'ca'): 'es-MX-DaliaNeural',
+}
+# Speech rate of edge voices for the slow voice type
+EDGE_SLOW_RATE = "-30%"
+
+# 500 ms of silence in mp3 format, used when speech can't be synthesized:
+# 21 MPEG-2 Layer III frames (24 kHz, 32 kbps, mono, like gTTS and edge-tts output)
+# of 96 bytes each, whose zeroed side information and main data decode to digital silence
+_SILENT_MP3_FRAME = b"\xff\xf3\x44\xc0" + bytes(92)
+SILENCE_MP3 = _SILENT_MP3_FRAME * 21
+
+# File name given to audio buffers, so Telegram recognizes them as mp3
+AUDIO_FILE_NAME = "speech.mp3"
+
+# Long texts are split on sentence boundaries and the sentences are synthesized in parallel,
+# at most TTS_WORKERS sentences of one text at a time
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+TTS_WORKERS = 4
+# The pool has room for every message handler thread of the bot (BOT_WORKERS in bot.py),
+# so a long text of one user never queues the sentences of other users
+_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BOT_WORKERS", 16)) * TTS_WORKERS, thread_name_prefix="tts"
+)
+
+def _voice_config(voice_type, language):
+    """
+    Get gTTS synthesis parameters for a voice type and a language.
+    
+    Args:
+        voice_type (str): Voice type ('normal', 'slow', 'clear', 'emotional')
+        language (str): Language code for the speech
+        
+    Returns:
+        tuple: (slow_speed, tld_domain) to pass to gTTS
+    """
+    slow_speed = False
+    tld_domain = "com"  # По умолчанию используем .com TLD
+    
+    # Настройка параметров в зависимости от типа голоса
+    if voice_type == 'slow':
+        # Для медленного голоса всегда используем slow=True
+        slow_speed = True
+    elif voice_type == 'clear':
+        # Для четкого голоса используем специальные настройки
+        if language in ['en', 'fr', 'es', 'it', 'pt']:
+            tld_domain = "co.uk"  # Британский акцент обычно более четкий
+        if language == 'ru':
+            tld_domain = "ru"  # Русский голос через локальный домен
+    elif voice_type == 'emotional':
+        # Для эмоционального голоса используем другие настройки
+        if language in ['es', 'it', 'fr']:
+            tld_domain = "ca"  # Канадский/латиноамериканский домен для некоторых языков
+    
+    # Особые настройки для азиатских языков
+    if language in ['ja', 'zh-CN', 'ko']:
+        # Для азиатских языков корректируем настройки
+        if voice_type in ['slow', 'clear']:
+            slow_speed = True
+        tld_domain = "com"  # Азиатские языки лучше через .com
+    
+    return slow_speed, tld_domain
+
+# Synthesis parameters precomputed for every known (voice_type, language) pair
+_VOICE_CONFIG = {
+    (voice_type, language): _voice_config(voice_type, language)
+    for voice_type in VOICE_TYPES
+    for language in AVAILABLE_AUDIO_LANGUAGES
+}
+
+def _cache_path(text, language, slow_speed, tld_domain):
+    """
+    Get the path of the cached audio for the given synthesis parameters.
+    
+    Args:
+        text (str): Text to convert to speech
+        language (str): Language code for the speech
+        slow_speed (bool): Whether the speech is slowed down
+        tld_domain (str): Google domain used for synthesis
+        
+    Returns:
+        str: Path to the cached audio file (it may not exist yet)
+    """
+    key = hashlib.sha256(f"{language}|{slow_speed}|{tld_domain}|{text}".encode("utf-8")).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+
+def _audio_buffer(data):
+    """
+    Wrap mp3 data into an in-memory file ready to be sent.
+    
+    Args:
+        data (bytes): Audio data in mp3 format
+        
+    Returns:
+        BytesIO: In-memory audio file positioned at its start
+    """
+    buffer = BytesIO(data)
+    buffer.name = AUDIO_FILE_NAME
+    return buffer
+
+def _silence():
+    """
+    Create a short silent audio used when speech can't be synthesized.
+    
+    Returns:
+        BytesIO: In-memory audio file with 500 ms of silence
+    """
+    return _audio_buffer(SILENCE_MP3)
+
+# Счетчик сохранений до следующей очистки; первая запись процесса сразу запускает очистку
+_stores_since_prune = TTS_CACHE_PRUNE_INTERVAL - 1
+_stores_lock = threading.Lock()
+# Очистку выполняет только один поток, остальные ее пропускают
+_prune_lock = threading.Lock()
+
+def _note_store():
+    """
+    Count a stored file and prune the cache once every TTS_CACHE_PRUNE_INTERVAL stores.
+    """
+    global _stores_since_prune
+    with _stores_lock:
+        _stores_since_prune += 1
+        if _stores_since_prune < TTS_CACHE_PRUNE_INTERVAL:
+            return
+        _stores_since_prune = 0
+    _prune_cache()
+
+def _prune_cache():
+    """
+    Remove the least recently used files when the cache grows over its limit,
+    and partial files left by interrupted writes.
+    """
+    if not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        now = time.time()
+        entries = []
+        for entry in os.scandir(TTS_CACHE_DIR):
+            try:
+                mtime = entry.stat().st_mtime
+                if entry.name.endswith(".mp3"):
+                    entries.append((mtime, entry.path))
+                elif entry.name.endswith(".part") and now - mtime > TTS_CACHE_PARTIAL_MAX_AGE:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Файл уже удален другим процессом
+                continue
+        
+        if len(entries) <= TTS_CACHE_MAX_FILES:
+            return
+        entries.sort()
+        for mtime, path in entries[:len(entries) - TTS_CACHE_MAX_FILES]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+    except OSError as e:
+        logger.warning(f"Failed to prune text-to-speech cache: {e}")
+    finally:
+        _prune_lock.release()
+
+def _read_cached(cache_path):
+    """
+    Read synthesized speech from the disk cache.
+    
+    Args:
+        cache_path (str): Path to the cached audio file
+        
+    Returns:
+        bytes: Audio data in mp3 format
+        
+    Raises:
+        FileNotFoundError: If the audio is not cached (or the cache cannot be read)
+    """
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            data = cache_file.read()
+        # Mark the file as recently used for pruning
+        os.utime(cache_path)
+        logger.info("Using cached speech audio")
+        return data
+    except FileNotFoundError:
+        raise
+    except OSError as e:
+        logger.warning(f"Failed to read text-to-speech cache: {e}")
+        raise FileNotFoundError(cache_path) from e
+
+def _store_cached(cache_path, data):
+    """
+    Store synthesized speech in the disk cache.
+    
+    Args:
+        cache_path (str): Path to the cached audio file
+        data (bytes): Audio data in mp3 format
+    """
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        # Write under a unique name first, so concurrent requests never see a partial file
+        fd, partial_path = tempfile.mkstemp(suffix=".part", dir=TTS_CACHE_DIR)
+        with os.fdopen(fd, 'wb') as partial_file:
+            partial_file.write(data)
+        os.replace(partial_path, cache_path)
+        _note_store()
+    except OSError as e:
+        logger.warning(f"Failed to store speech audio in cache: {e}")
+
+def _edge_voice(language, tld_domain):
+    """
+    Get the edge-tts voice for a language, if the edge engine is enabled.
+    
+    Args:
+        language (str): Language code for the speech
+        tld_domain (str): Google domain that would be used by gTTS
+        
+    Returns:
+        str: Edge voice name, or None if gTTS should be used
+    """
+    if TTS_ENGINE != "edge" or edge_tts is None:
+        return None
+    return EDGE_REGIONAL_VOICES.get((language, tld_domain)) or EDGE_VOICES.get(language)
+
+async def _stream_edge(text, voice, rate):
+    """
+    Collect audio frames streamed by edge-tts.
+    
+    Args:
+        text (str): Text to convert to speech
+        voice (str): Edge voice name
+        rate (str): Speech rate change (e.g., '+0%', '-30%')
+        
+    Returns:
+        bytes: Audio data in mp3 format
+    """
+    buffer = BytesIO()
+    communicate = edge_tts.Communicate(text, voice, rate=rate)
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            buffer.write(chunk["data"])
+    return buffer.getvalue()
+
+def _synthesize_edge(text, voice, slow_speed):
+    """
+    Synthesize speech with edge-tts.
+    
+    Args:
+        text (str): Text to convert to speech
+        voice (str): Edge voice name
+        slow_speed (bool): Whether the speech is slowed down
+        
+    Returns:
+        bytes: Audio data in mp3 format
+    """
+    rate = EDGE_SLOW_RATE if slow_speed else "+0%"
+    # Обработчики бота работают в потоках, поэтому у каждого вызова свой цикл событий
+    data = asyncio.run(_stream_edge(text, voice, rate))
+    if not data:
+        raise RuntimeError(f"edge-tts returned no audio for voice {voice}")
+    return data
+
+def _synthesize(text, language, slow_speed, tld_domain):
+    """
+    Synthesize speech with gTTS or edge-tts, reusing the disk cache when possible.
+    
+    Args:
+        text (str): Text to convert to speech
+        language (str): Language code for the speech
+        slow_speed (bool): Whether the speech is slowed down
+        tld_domain (str): Google domain used for synthesis
+        
+    Returns:
+        bytes: Audio data in mp3 format
+    """
+    voice = _edge_voice(language, tld_domain)
+    if voice is not None:
+        # Имя голоса Edge не совпадает с кодами языков, поэтому ключи кэша не пересекаются
+        edge_cache_path = _cache_path(text, voice, slow_speed, "edge")
+        try:
+            return _read_cached(edge_cache_path)
+        except FileNotFoundError:
+            pass
+        try:
+            data = _synthesize_edge(text, voice, slow_speed)
+            _store_cached(edge_cache_path, data)
+            return data
+        except Exception as e:
+            logger.warning(f"edge-tts failed, falling back to gTTS: {e}")
+    
+    cache_path = _cache_path(text, language, slow_speed, tld_domain)
+    try:
+        return _read_cached(cache_path)
+    except FileNotFoundError:
+        pass
+    
+    buffer = BytesIO()
+    tts = gTTS(text=text, lang=language, slow=slow_speed, tld=tld_domain)
+    tts.write_to_fp(buffer)
+    data = buffer.getvalue()
+    _store_cached(cache_path, data)
+    return data
+
 def text_to_speech(text, language='en', voice_type='normal'):
     """
     Convert text to speech using Google Text-to-Speech with enhanced voice options.
@@ -21,104 +393,138 @@ def text_to_speech(text, language='en', voice_type='normal'):
         voice_type (str): Voice type ('normal', 'slow', 'clear', 'emotional')
         
     Returns:
-        str: Path to the generated audio file
+        BytesIO: In-memory mp3 file with the generated audio
     """
     if not text:
         logger.warning("Empty text provided for text-to-speech")
-        # Create a temporary file with silence
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        temp_file.close()
-        silence = AudioSegment.silent(duration=500)  # 500ms of silence
-        silence.export(temp_file.name, format="mp3")
-        return temp_file.name
+        return _silence()
     
     try:
-        # Create a temporary file for the audio
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        temp_file.close()
+        return _audio_buffer(_synthesize_text(text, language, voice_type))
+    
+    except Exception as e:
+        logger.error(f"Error in text-to-speech conversion: {e}")
+        # Return a silent audio file
+        return _silence()
+
+def _synthesize_text(text, language, voice_type):
+    """
+    Synthesize speech for a text with the parameters of the voice type.
+    
+    Args:
+        text (str): Text to convert to speech
+        language (str): Language code for the speech
+        voice_type (str): Voice type ('normal', 'slow', 'clear', 'emotional')
         
-        # Convert text to speech with enhanced voice options
-        logger.info(f"Converting text to speech in language: {language}, voice type: {voice_type}")
+    Returns:
+        bytes: Audio data in mp3 format
         
-        # Настраиваем параметры в зависимости от типа голоса
-        slow_speed = False
-        tld_domain = "com"  # По умолчанию используем .com TLD
+    Raises:
+        Exception: If the speech can't be synthesized
+    """
+    # Convert text to speech with enhanced voice options
+    logger.info(f"Converting text to speech in language: {language}, voice type: {voice_type}")
+    
+    # Параметры синтеза для типа голоса и языка
+    slow_speed, tld_domain = _VOICE_CONFIG.get((voice_type, language)) or _voice_config(voice_type, language)
+    
+    # Синтезируем речь (или берем готовое аудио из кэша)
+    return _synthesize(text, language, slow_speed, tld_domain)
+
+def text_to_speech_streamed(text, language='en', voice_type='normal'):
+    """
+    Convert text to speech, synthesizing its sentences in parallel.
+    
+    Multi-sentence texts are split on sentence boundaries, every sentence is
+    synthesized in a thread pool and the MP3 parts are joined in order (MP3
+    streams can be concatenated frame by frame, as gTTS itself does). If any
+    sentence fails, the whole text is converted by text_to_speech() instead,
+    so no sentence is silently left out.
+    
+    Args:
+        text (str): Text to convert to speech
+        language (str): Language code for the speech (default: 'en')
+        voice_type (str): Voice type ('normal', 'slow', 'clear', 'emotional')
         
-        # Настройка параметров в зависимости от типа голоса
-        if voice_type == 'slow':
-            # Для медленного голоса всегда используем slow=True
-            slow_speed = True
-        elif voice_type == 'clear':
-            # Для четкого голоса используем специальные настройки
-            if language in ['en', 'fr', 'es', 'it', 'pt']:
-                tld_domain = "co.uk"  # Британский акцент обычно более четкий
-            if language == 'ru':
-                tld_domain = "ru"  # Русский голос через локальный домен
-        elif voice_type == 'emotional':
-            # Для эмоционального голоса используем другие настройки
-            if language in ['es', 'it', 'fr']:
-                tld_domain = "ca"  # Канадский/латиноамериканский домен для некоторых языков
-        
-        # Особые настройки для азиатских языков
-        if language in ['ja', 'zh-CN', 'ko']:
-            # Для азиатских языков корректируем настройки
-            if voice_type in ['slow', 'clear']:
-                slow_speed = True
-            tld_domain = "com"  # Азиатские языки лучше через .com
-        
-        # Создаем объект gTTS с настроенными параметрами
-        tts = gTTS(text=text, lang=language, slow=slow_speed, tld=tld_domain)
-        
-        # Сохраняем аудио
-        tts.save(temp_file.name)
-        
-        return temp_file.name
+    Returns:
+        BytesIO: In-memory mp3 file with the generated audio
+    """
+    sentences = _SENTENCE_BOUNDARY.split(text.strip()) if text else []
+    if len(sentences) < 2:
+        return text_to_speech(text, language, voice_type)
     
+    logger.info(f"Converting {len(sentences)} sentences to speech in parallel")
+    parts = []
+    try:
+        for start in range(0, len(sentences), TTS_WORKERS):
+            batch = sentences[start:start + TTS_WORKERS]
+            parts.extend(_pool.map(lambda sentence: _synthesize_text(sentence, language, voice_type), batch))
     except Exception as e:
-        logger.error(f"Error in text-to-speech conversion: {e}")
-        # Return a path to a silent audio file
-        fallback_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        fallback_file.close()
-        silence = AudioSegment.silent(duration=500)  # 500ms of silence
-        silence.export(fallback_file.name, format="mp3")
-        return fallback_file.name
+        logger.warning(f"Failed to synthesize sentences in parallel, converting the whole text: {e}")
+        return text_to_speech(text, language, voice_type)
+    return _audio_buffer(b"".join(parts))
 
-def adjust_audio_speed(audio_path, speed=1.0):
+def _atempo_filter(speed):
+    """
+    Build an ffmpeg filter changing the tempo of audio by the given factor.
+    
+    A single atempo stage accepts factors from 0.5 to 2.0 only,
+    so larger changes are split into several stages.
+    
+    Args:
+        speed (float): Speed factor (1.0 is normal speed)
+        
+    Returns:
+        str: Value for the ffmpeg -filter:a option
+    """
+    stages = []
+    while speed > 2.0:
+        stages.append("atempo=2.0")
+        speed /= 2.0
+    while speed < 0.5:
+        stages.append("atempo=0.5")
+        speed /= 0.5
+    stages.append(f"atempo={speed}")
+    return ",".join(stages)
+
+def adjust_audio_speed(audio, speed=1.0):
     """
     Adjust the playback speed of an audio file.
     
     Args:
-        audio_path (str): Path to the audio file
+        audio (BytesIO): In-memory mp3 file
         speed (float): Speed factor (1.0 is normal speed)
         
     Returns:
-        str: Path to the speed-adjusted audio file
+        BytesIO: In-memory mp3 file with the speed-adjusted audio
     """
-    if not os.path.exists(audio_path):
-        logger.error(f"Audio file not found: {audio_path}")
-        return audio_path
+    try:
+        speed = float(speed)
+    except (TypeError, ValueError):
+        speed = 1.0
+    if not math.isfinite(speed) or speed <= 0:
+        logger.warning(f"Invalid audio speed {speed}, keeping normal speed")
+        speed = 1.0
+    # Скорость ограничиваем диапазоном, который предлагает бот
+    speed = min(max(speed, min(SPEED_OPTIONS)), max(SPEED_OPTIONS))
+    if speed == 1.0:
+        # Нормальная скорость - перекодировать нечего
+        audio.seek(0)
+        return audio
     
     try:
-        # Load the audio file
-        audio = AudioSegment.from_file(audio_path)
-        
-        # Create a temporary file for the adjusted audio
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        temp_file.close()
-        
-        # Adjust the speed
-        # For changing speed without changing pitch, we modify the frame rate
+        # Adjust the speed with a single ffmpeg run: the atempo filter changes
+        # the tempo without changing the pitch; the audio is passed through pipes
         logger.info(f"Adjusting audio speed to {speed}x")
-        adjusted_audio = audio._spawn(audio.raw_data, overrides={
-            "frame_rate": int(audio.frame_rate * speed)
-        })
-        adjusted_audio = adjusted_audio.set_frame_rate(audio.frame_rate)
-        
-        # Export the adjusted audio
-        adjusted_audio.export(temp_file.name, format="mp3")
+        result = subprocess.run(
+            ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+             '-filter:a', _atempo_filter(speed), '-vn', '-f', 'mp3', 'pipe:1'],
+            input=audio.getvalue(), stdout=subprocess.PIPE, check=True
+        )
         
-        return temp_file.name
+        return _audio_buffer(result.stdout)
     
     except Exception as e:
         logger.error(f"Error adjusting audio speed: {e}")
-        return audio_path  # Return the original audio file in case of error
+        audio.seek(0)
+        return audio  # Return the original audio in case of error
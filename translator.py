@@ -3,41 +3,115 @@ Translator module for text translation between languages.
 Uses the deep-translator library for translations.
 """
 import logging
+import re
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+import requests
+from requests.adapters import HTTPAdapter
+import deep_translator.google
 from deep_translator import GoogleTranslator
 
 # Logger for this module
 logger = logging.getLogger(__name__)
 
+# Translators and HTTP sessions are reused per thread: GoogleTranslator keeps the
+# text of the current request in its own state, so an instance can't be shared
+# between the bot's worker threads
+_local = threading.local()
+
+# Maximal number of translators (language pairs) kept per thread
+MAX_TRANSLATORS_PER_THREAD = 64
+
+def _get_session():
+    """
+    Get the HTTP session of the current thread, keeping connections alive between requests.
+    
+    Returns:
+        requests.Session: Session of the current thread
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+        _local.session = session
+    return session
+
+class _SessionRequests:
+    """
+    Stand-in for the requests module used by deep-translator.
+    
+    deep-translator calls requests.get() for every translation, which opens
+    a new connection each time; this sends the calls through the thread's session.
+    """
+    
+    def get(self, *args, **kwargs):
+        return _get_session().get(*args, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+deep_translator.google.requests = _SessionRequests()
+
+def _get_translator(source_language, target_language):
+    """
+    Get a translator for the language pair, reused within the current thread.
+    
+    Args:
+        source_language (str): Source language code, or 'auto' for auto-detection
+        target_language (str): Target language code
+        
+    Returns:
+        GoogleTranslator: Translator for the language pair
+    """
+    translators = getattr(_local, "translators", None)
+    if translators is None or len(translators) >= MAX_TRANSLATORS_PER_THREAD:
+        translators = _local.translators = {}
+    
+    key = (source_language, target_language)
+    translator = translators.get(key)
+    if translator is None:
+        translator = translators[key] = GoogleTranslator(source=source_language, target=target_language)
+    return translator
+
+# A subset of commonly used languages to avoid overwhelming the user.
+# Read-only, so the same mapping can be shared by all callers
+COMMON_LANGUAGES = MappingProxyType({
+    'en': 'English',
+    'es': 'Spanish',
+    'fr': 'French',
+    'de': 'German',
+    'it': 'Italian',
+    'pt': 'Portuguese',
+    'ru': 'Russian',
+    'zh-CN': 'Chinese (Simplified)',
+    'ja': 'Japanese',
+    'ko': 'Korean',
+    'ar': 'Arabic',
+    'hi': 'Hindi',
+    'tr': 'Turkish',
+    'nl': 'Dutch',
+    'sv': 'Swedish',
+    'fi': 'Finnish',
+    'pl': 'Polish',
+    'uk': 'Ukrainian'
+})
+
+# Several short texts are translated in one request, joined with a separator
+# that is unlikely to appear in user input (Google may change spaces around it)
+BATCH_SEPARATOR = "\n⟦SEP⟧\n"
+_BATCH_SEPARATOR_PATTERN = re.compile(r"\s*⟦\s*SEP\s*⟧\s*", re.IGNORECASE)
+# Google Translate accepts less than 5000 characters per request
+MAX_BATCH_LENGTH = 4500
+
 def get_available_languages():
     """
     Get a dictionary of available languages for translation.
     
     Returns:
-        dict: Dictionary of language codes and names
-    """
-    # Define a subset of commonly used languages to avoid overwhelming the user
-    common_languages = {
-        'en': 'English',
-        'es': 'Spanish',
-        'fr': 'French',
-        'de': 'German',
-        'it': 'Italian',
-        'pt': 'Portuguese',
-        'ru': 'Russian',
-        'zh-CN': 'Chinese (Simplified)',
-        'ja': 'Japanese',
-        'ko': 'Korean',
-        'ar': 'Arabic',
-        'hi': 'Hindi',
-        'tr': 'Turkish',
-        'nl': 'Dutch',
-        'sv': 'Swedish',
-        'fi': 'Finnish',
-        'pl': 'Polish',
-        'uk': 'Ukrainian'
-    }
-    
-    return common_languages
+        Mapping: Read-only mapping of language codes and names
+    """
+    return COMMON_LANGUAGES
 
 def translate_text(text, target_language, source_language='auto'):
     """
@@ -59,12 +133,13 @@ def translate_text(text, target_language, source_language='auto'):
         logger.info(f"Source and target languages are the same ({target_language}), skipping translation")
         return text
     
+    # Surrounding whitespace does not change the translation, so it is not part of the cache key
+    normalized_text = text.strip()
+    if not normalized_text:
+        return text
+    
     try:
-        # Create a translator with source and target language
-        translator = GoogleTranslator(source=source_language, target=target_language)
-        
-        # Translate the text
-        translated = translator.translate(text)
+        translated = _translate_cached(normalized_text, target_language, source_language)
         logger.info(f"Translated text from {source_language} to {target_language}")
         
         return translated
@@ -72,3 +147,89 @@ def translate_text(text, target_language, source_language='auto'):
     except Exception as e:
         logger.error(f"Error translating text: {e}")
         return text  # Return original text in case of error
+
+@lru_cache(maxsize=2048)
+def _translate_cached(text, target_language, source_language):
+    """
+    Translate text with Google Translate, remembering recent results.
+    
+    Failed translations raise and are therefore never cached.
+    
+    Args:
+        text (str): Text to translate
+        target_language (str): Target language code
+        source_language (str): Source language code, or 'auto' for auto-detection
+        
+    Returns:
+        str: Translated text
+    """
+    # Translate the text with the translator of this language pair
+    return _get_translator(source_language, target_language).translate(text)
+
+def translate_many(texts, target_language, source_language='auto'):
+    """
+    Translate several texts to the target language with as few requests as possible.
+    
+    Texts are joined with BATCH_SEPARATOR into requests of up to MAX_BATCH_LENGTH
+    characters; if a translated batch can't be split back into the same number
+    of texts, its texts are translated one by one.
+    
+    Args:
+        texts (list): Texts to translate
+        target_language (str): Target language code (e.g., 'en', 'es', 'fr')
+        source_language (str): Source language code, or 'auto' for auto-detection (default: 'auto')
+        
+    Returns:
+        list: Translated texts in the same order (original text for failed translations)
+    """
+    results = list(texts)
+    if not target_language or (source_language != 'auto' and source_language == target_language):
+        return results
+    
+    # Пустые строки не переводим
+    pending = [index for index, text in enumerate(results) if text and text.strip()]
+    if len(pending) <= 1:
+        return [translate_text(text, target_language, source_language) for text in results]
+    
+    batch = []
+    batch_length = 0
+    for index in pending:
+        text_length = len(results[index].strip()) + len(BATCH_SEPARATOR)
+        if batch and batch_length + text_length > MAX_BATCH_LENGTH:
+            _translate_batch(results, batch, target_language, source_language)
+            batch = []
+            batch_length = 0
+        batch.append(index)
+        batch_length += text_length
+    _translate_batch(results, batch, target_language, source_language)
+    return results
+
+def _translate_batch(results, indices, target_language, source_language):
+    """
+    Translate the texts at the given positions with one request, in place.
+    
+    Args:
+        results (list): Texts, translated ones are replaced
+        indices (list): Positions of the texts to translate together
+        target_language (str): Target language code
+        source_language (str): Source language code, or 'auto' for auto-detection
+    """
+    if len(indices) > 1:
+        joined_text = BATCH_SEPARATOR.join(results[index].strip() for index in indices)
+        try:
+            translated = _translate_cached(joined_text, target_language, source_language)
+        except Exception as e:
+            # Запрос не прошел - отдельные запросы для каждого текста тоже не пройдут
+            logger.error(f"Error translating batch of {len(indices)} texts: {e}")
+            return
+        
+        parts = _BATCH_SEPARATOR_PATTERN.split(translated.strip())
+        if len(parts) == len(indices):
+            for index, part in zip(indices, parts):
+                results[index] = part
+            logger.info(f"Translated {len(indices)} texts from {source_language} to {target_language}")
+            return
+        logger.warning("Batch translation could not be split, translating texts one by one")
+    
+    for index in indices:
+        results[index] = translate_text(results[index], target_language, source_language)
@@ -2,42 +2,55 @@
 User preferences module for storing and managing user settings.
 """
 import logging
+import threading
+from collections import OrderedDict
 
 from constants import (
     DEFAULT_SOURCE_LANGUAGE, DEFAULT_LANGUAGE, DEFAULT_SPEED, DEFAULT_AUDIO_LANGUAGE, 
-    AVAILABLE_AUDIO_LANGUAGES, DEFAULT_VOICE_TYPE, VOICE_TYPES
+    DEFAULT_VOICE_TYPE
 )
-from translator import get_available_languages
 from database import (
     get_or_create_user_settings,
-    update_user_source_language as db_update_source_language,
-    update_user_language as db_update_language,
-    update_user_audio_language as db_update_audio_language,
-    update_user_speed as db_update_speed,
-    update_user_voice_type as db_update_voice_type
+    prefetch_user_settings,
+    display_name,
+    with_display_names,
+    update_user_settings as db_update_settings
 )
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
 
+# Максимальное количество пользователей, настройки которых держим в памяти
+PREFS_CACHE_MAX_USERS = 10_000
+
+# LRU-кэш объектов UserPreferences: {user_id: UserPreferences}
+_prefs_cache = OrderedDict()
+_prefs_lock = threading.Lock()
+
 class UserPreferences:
     """
     Class for storing user preferences including translation language, audio language, speech speed, and voice type.
     Uses database for persistent storage.
+    
+    Every update_* method is saved immediately; save() stores several
+    preferences together with a single UPDATE.
     """
     
-    def __init__(self, user_id):
+    def __init__(self, user_id, settings=None):
         """
         Initialize user preferences from database or with default values if not found.
         
         Args:
             user_id: Telegram user ID
+            settings: Already loaded UserSettings of the user (optional)
         """
         self.user_id = user_id
         
         try:
             # Получаем настройки пользователя из базы данных или создаем новые
-            settings = get_or_create_user_settings(user_id)
+            preloaded = settings is not None
+            if not preloaded:
+                settings = get_or_create_user_settings(user_id)
             
             # Устанавливаем атрибуты из настроек базы данных
             self.source_language = settings.source_language
@@ -49,13 +62,8 @@ class UserPreferences:
                 self.speed = DEFAULT_SPEED
             self.voice_type = settings.voice_type
             
-            # Получаем имена языков и типа голоса
-            self.source_language_name = settings.source_language_name
-            self.language_name = settings.language_name
-            self.audio_language_name = settings.audio_language_name
-            self.voice_type_name = settings.voice_type_name
-            
-            logger.info(f"Loaded preferences for user {user_id} from database")
+            if not preloaded:
+                logger.info(f"Loaded preferences for user {user_id} from database")
         except Exception as e:
             # В случае ошибки, используем значения по умолчанию
             logger.error(f"Failed to load preferences from database for user {user_id}: {e}")
@@ -65,22 +73,48 @@ class UserPreferences:
             self.audio_language = DEFAULT_AUDIO_LANGUAGE
             self.speed = DEFAULT_SPEED
             self.voice_type = DEFAULT_VOICE_TYPE
+    
+    # Имена языков и типа голоса нужны только для отображения настроек,
+    # поэтому вычисляются по кодам при обращении
+    @property
+    def source_language_name(self):
+        return display_name("source_language", self.source_language)
+    
+    @property
+    def language_name(self):
+        return display_name("language", self.language)
+    
+    @property
+    def audio_language_name(self):
+        return display_name("audio_language", self.audio_language)
+    
+    @property
+    def voice_type_name(self):
+        return display_name("voice_type", self.voice_type)
+    
+    def save(self, **changes):
+        """
+        Save several preferences at once with a single database write.
+        
+        Args:
+            **changes: New values of preferences (source_language, language,
+                audio_language, voice_type, speed)
+        """
+        if not changes:
+            return
+        try:
+            values = with_display_names(changes)
             
-            # Получаем имена языков и типа голоса
-            if DEFAULT_SOURCE_LANGUAGE == "auto":
-                self.source_language_name = "Автоопределение"
-            else:
-                source_lang_name = get_available_languages().get(DEFAULT_SOURCE_LANGUAGE)
-                self.source_language_name = source_lang_name if source_lang_name else DEFAULT_SOURCE_LANGUAGE.upper()
-                
-            lang_name = get_available_languages().get(DEFAULT_LANGUAGE)
-            self.language_name = lang_name if lang_name else DEFAULT_LANGUAGE.upper()
+            # Обновляем значения в базе данных одним запросом
+            db_update_settings(self.user_id, **changes)
             
-            audio_lang_name = AVAILABLE_AUDIO_LANGUAGES.get(DEFAULT_AUDIO_LANGUAGE)
-            self.audio_language_name = audio_lang_name if audio_lang_name else DEFAULT_AUDIO_LANGUAGE.upper()
+            # Обновляем локальные атрибуты (имена вычисляются по ним)
+            for name in changes:
+                setattr(self, name, values[name])
             
-            voice_type_name = VOICE_TYPES.get(DEFAULT_VOICE_TYPE)
-            self.voice_type_name = voice_type_name if voice_type_name else DEFAULT_VOICE_TYPE.upper()
+            logger.info(f"Updated preferences for user {self.user_id}: {changes}")
+        except Exception as e:
+            logger.error(f"Failed to update preferences for user {self.user_id}: {e}")
     
     def update_language(self, language_code):
         """
@@ -89,22 +123,7 @@ class UserPreferences:
         Args:
             language_code (str): Language code (e.g., 'en', 'es', 'fr')
         """
-        try:
-            # Обновляем значение в базе данных
-            db_update_language(self.user_id, language_code)
-            
-            # Обновляем локальные атрибуты
-            self.language = language_code
-            language_name = get_available_languages().get(language_code)
-            if language_name:
-                self.language_name = language_name
-            else:
-                # Если язык не найден в списке, используем код языка с заглавной буквы
-                self.language_name = language_code.upper()
-            
-            logger.info(f"Updated language for user {self.user_id} to {language_code}")
-        except Exception as e:
-            logger.error(f"Failed to update language for user {self.user_id}: {e}")
+        self.save(language=language_code)
     
     def update_audio_language(self, language_code):
         """
@@ -113,22 +132,7 @@ class UserPreferences:
         Args:
             language_code (str): Language code (e.g., 'en', 'es', 'fr')
         """
-        try:
-            # Обновляем значение в базе данных
-            db_update_audio_language(self.user_id, language_code)
-            
-            # Обновляем локальные атрибуты
-            self.audio_language = language_code
-            audio_language_name = AVAILABLE_AUDIO_LANGUAGES.get(language_code)
-            if audio_language_name:
-                self.audio_language_name = audio_language_name
-            else:
-                # Если язык не найден в списке, используем код языка с заглавной буквы
-                self.audio_language_name = language_code.upper()
-            
-            logger.info(f"Updated audio language for user {self.user_id} to {language_code}")
-        except Exception as e:
-            logger.error(f"Failed to update audio language for user {self.user_id}: {e}")
+        self.save(audio_language=language_code)
     
     def update_speed(self, speed):
         """
@@ -137,19 +141,7 @@ class UserPreferences:
         Args:
             speed (float): Speed factor (e.g., 0.5, 0.7, 0.8, 0.9, 1.0, 1.25, 1.5, 2.0)
         """
-        try:
-            # Преобразуем в float для безопасности
-            speed_float = float(speed)
-            
-            # Обновляем значение в базе данных
-            db_update_speed(self.user_id, speed_float)
-            
-            # Обновляем локальный атрибут
-            self.speed = speed_float
-            
-            logger.info(f"Updated speed for user {self.user_id} to {speed_float}")
-        except Exception as e:
-            logger.error(f"Failed to update speed for user {self.user_id}: {e}")
+        self.save(speed=speed)
         
     def update_source_language(self, language_code):
         """
@@ -158,25 +150,7 @@ class UserPreferences:
         Args:
             language_code (str): Language code (e.g., 'en', 'es', 'fr', or 'auto' for auto-detection)
         """
-        try:
-            # Обновляем значение в базе данных
-            db_update_source_language(self.user_id, language_code)
-            
-            # Обновляем локальные атрибуты
-            self.source_language = language_code
-            if language_code == 'auto':
-                self.source_language_name = "Автоопределение"
-            else:
-                language_name = get_available_languages().get(language_code)
-                if language_name:
-                    self.source_language_name = language_name
-                else:
-                    # Если язык не найден в списке, используем код языка с заглавной буквы
-                    self.source_language_name = language_code.upper()
-            
-            logger.info(f"Updated source language for user {self.user_id} to {language_code}")
-        except Exception as e:
-            logger.error(f"Failed to update source language for user {self.user_id}: {e}")
+        self.save(source_language=language_code)
     
     def update_voice_type(self, voice_type):
         """
@@ -185,14 +159,64 @@ class UserPreferences:
         Args:
             voice_type (str): Voice type code (e.g., 'normal', 'slow', 'clear', 'emotional')
         """
-        try:
-            # Обновляем значение в базе данных
-            db_update_voice_type(self.user_id, voice_type)
-            
-            # Обновляем локальные атрибуты
-            self.voice_type = voice_type
-            self.voice_type_name = VOICE_TYPES.get(voice_type, "Unknown")
-            
-            logger.info(f"Updated voice type for user {self.user_id} to {voice_type}")
-        except Exception as e:
-            logger.error(f"Failed to update voice type for user {self.user_id}: {e}")
\ No newline at end of file
+        self.save(voice_type=voice_type)
+
+
+def get_prefs(user_id):
+    """
+    Get preferences of a user, loading them from the database only on the first request.
+    
+    The objects are kept in an LRU cache; their update_* methods change them in
+    place and write through to the database, so a cached object is never stale.
+    
+    Args:
+        user_id: Telegram user ID
+        
+    Returns:
+        UserPreferences: Preferences of the user
+    """
+    with _prefs_lock:
+        prefs = _prefs_cache.get(user_id)
+        if prefs is not None:
+            _prefs_cache.move_to_end(user_id)
+            return prefs
+    
+    # Загружаем из базы данных вне блокировки, чтобы не задерживать других пользователей
+    prefs = UserPreferences(user_id)
+    
+    with _prefs_lock:
+        # Другой поток мог успеть загрузить настройки раньше - используем его объект
+        prefs = _prefs_cache.setdefault(user_id, prefs)
+        _prefs_cache.move_to_end(user_id)
+        while len(_prefs_cache) > PREFS_CACHE_MAX_USERS:
+            _prefs_cache.popitem(last=False)
+    return prefs
+
+def prefetch_prefs(user_ids=None, limit=None):
+    """
+    Load preferences of several users into memory with a single database query.
+    
+    Used at startup to warm the cache for active users, so their first
+    message doesn't wait for the database.
+    
+    Args:
+        user_ids: Telegram user IDs; if None, the most recently registered users are loaded
+        limit: Maximal number of users to load when user_ids is None
+        
+    Returns:
+        int: Number of users whose preferences were loaded
+    """
+    if limit is None or limit > PREFS_CACHE_MAX_USERS:
+        limit = PREFS_CACHE_MAX_USERS
+    settings_list = prefetch_user_settings(user_ids, limit)
+    
+    with _prefs_lock:
+        # Новые пользователи добавляются последними, чтобы вытесняться из кэша позже
+        for settings in reversed(settings_list):
+            # В базе user_id хранится строкой, а бот использует числовой ID
+            user_id = int(settings.user_id) if settings.user_id.isdigit() else settings.user_id
+            if user_id not in _prefs_cache:
+                _prefs_cache[user_id] = UserPreferences(user_id, settings)
+        while len(_prefs_cache) > PREFS_CACHE_MAX_USERS:
+            _prefs_cache.popitem(last=False)
+    return len(settings_list)